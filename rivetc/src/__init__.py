@@ -6,7 +6,7 @@ from os import path
 import os, copy, glob
 
 from . import (
-    ast, sym, type, token, prefs, report, utils,
+    ast, sym, type, token, prefs, report, utils, cache, layout, consteval,
 
     # stages
     parser, register, resolver, checker, codegen
@@ -53,6 +53,12 @@ class Compiler:
         self.parsed_files = []
         self.source_files = []
 
+        # only used by `--check`, the checked AST is needed by codegen
+        self.check_cache = None
+
+        self.layout = layout.Layout(self)
+        self.const_eval = consteval.ConstEval(self)
+
         self.register = register.Register(self)
         self.resolver = resolver.Resolver(self)
         self.checker = checker.Checker(self)
@@ -77,11 +83,22 @@ class Compiler:
             self.resolver.resolve_files(self.source_files)
             if report.ERRORS > 0:
                 self.abort()
+            sym.build_member_tables(self.universe)
             self.vlog("checking files...")
+            if self.prefs.check:
+                self.check_cache = cache.CheckCache(self)
+                self.check_cache.load(self.source_files)
             self.checker.check_files(self.source_files)
             if report.ERRORS > 0:
                 self.abort()
+            if self.check_cache:
+                self.check_cache.save()
             if not self.prefs.check:
+                self.layout.compute_all(self.universe)
+                if self.layout.saved_bytes > 0:
+                    self.vlog(
+                        f"reorder fields: {self.layout.saved_bytes} bytes saved in total"
+                    )
                 self.vlog("generating RIR...")
                 self.codegen.gen_source_files(self.source_files)
                 if report.ERRORS > 0:
@@ -394,94 +411,12 @@ class Compiler:
     # Returns the size and alignment (in bytes) of `typ`, similarly to
     # C's `sizeof(T)` and `_Alignof(T)`.
     def type_size(self, typ):
-        if isinstance(typ, (type.Result, type.Option)):
-            return self.type_size(typ.typ)
-        elif isinstance(typ, (type.Ptr, type.Func, type.Boxedptr)):
-            return self.pointer_size, self.pointer_size
-        return self.type_symbol_size(typ.symbol())
+        layout = self.layout.type_layout(typ)
+        return layout.size, layout.align
 
     def type_symbol_size(self, sy):
-        if sy.size != -1:
-            return sy.size, sy.align
-        size, align = 0, 0
-        if sy.kind in (
-            sym.TypeKind.Placeholder, sym.TypeKind.Void, sym.TypeKind.None_,
-            sym.TypeKind.Never
-        ):
-            pass
-        elif sy.kind == sym.TypeKind.Alias:
-            size, align = self.type_size(sy.info.parent)
-        elif sy.kind in (sym.TypeKind.Uint, sym.TypeKind.Int):
-            size, align = self.pointer_size, self.pointer_size
-        elif sy.kind in (
-            sym.TypeKind.Int8, sym.TypeKind.Uint8, sym.TypeKind.Bool
-        ):
-            size, align = 1, 1
-        elif sy.kind in (sym.TypeKind.Int16, sym.TypeKind.Uint16):
-            size, align = 2, 2
-        elif sy.kind in (
-            sym.TypeKind.Int32, sym.TypeKind.Uint32, sym.TypeKind.Rune,
-            sym.TypeKind.Float32
-        ):
-            size, align = 4, 4
-        elif sy.kind in (
-            sym.TypeKind.Int64, sym.TypeKind.Uint64, sym.TypeKind.Float64,
-            sym.TypeKind.ComptimeFloat, sym.TypeKind.ComptimeInt
-        ):
-            size, align = 8, 8
-        elif sy.kind == sym.TypeKind.Enum:
-            if sy.info.is_tagged:
-                if sy.info.is_boxed:
-                    size, align = self.pointer_size, self.pointer_size
-                else:
-                    total_size = self.pointer_size
-                    max_alignment = self.pointer_size
-                    for variant in sy.info.variants:
-                        if variant.has_typ:
-                            variant_size, alignment = self.type_size(
-                                variant.typ
-                            )
-                            if alignment > max_alignment:
-                                max_alignment = alignment
-                            total_size = utils.round_up(
-                                total_size, alignment
-                            ) + variant_size
-                    size = utils.round_up(total_size, max_alignment)
-                    align = max_alignment
-            else:
-                size, align = self.type_size(sy.info.underlying_typ)
-        elif sy.kind == sym.TypeKind.Array:
-            elem_size, elem_align = self.type_size(sy.info.elem_typ)
-            size, align = int(sy.info.size.lit) * elem_size, elem_align
-        elif sy.kind == sym.TypeKind.Slice:
-            size, align = self.pointer_size * 3, self.pointer_size
-        elif sy.is_boxed():
-            size, align = self.pointer_size, self.pointer_size
-        elif sy.kind in (sym.TypeKind.Struct, sym.TypeKind.Tuple):
-            if sy.kind == sym.TypeKind.Struct and sy.info.is_boxed:
-                size, align = self.pointer_size, self.pointer_size
-            else:
-                total_size = 0
-                max_alignment = 0
-                types = sy.info.types if sy.kind == sym.TypeKind.Tuple else list(
-                    map(lambda it: it.typ, sy.full_fields())
-                )
-                for ftyp in types:
-                    field_size, alignment = self.type_size(ftyp)
-                    if alignment > max_alignment:
-                        max_alignment = alignment
-                    total_size = utils.round_up(
-                        total_size, alignment
-                    ) + field_size
-                size = utils.round_up(total_size, max_alignment)
-                align = max_alignment
-        else:
-            raise Exception(
-                f"Compiler.type_size(): unsupported type `{sy.qualname()}`"
-            )
-        sy.size = size
-        sy.align = align
-        return size, align
+        layout = self.layout.type_symbol_layout(sy)
+        return layout.size, layout.align
 
     def evalue_comptime_if(self, comptime_if):
         if comptime_if.branch_idx != None:
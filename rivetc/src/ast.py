@@ -18,6 +18,8 @@ class SourceFile:
         self.sym = sym
         self.decls = decls
         self.imported_symbols = {}
+        # hash of every token outside function bodies, see `cache.py`
+        self.interface_hash = ""
 
     def find_imported_symbol(self, name):
         if name in self.imported_symbols:
@@ -312,6 +314,7 @@ class FuncDecl:
         self.scope = scope
         self.stmts = stmts
         self.defer_stmts = []
+        self.body_hash = ""
 
 class TestDecl:
     def __init__(self, scope, name, stmts, pos):
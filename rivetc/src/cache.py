@@ -0,0 +1,223 @@
+# Copyright (C) 2023 Jose Mendoza. All rights reserved.
+# Use of this source code is governed by an MIT license that can
+# be found in the LICENSE file.
+
+from os import path
+import os, json, shutil, hashlib
+
+from . import prefs, utils
+
+CACHE_DIR = path.join(prefs.RIVET_DIR, "cache")
+OBJ_DIR = path.join(prefs.RIVET_DIR, "obj")
+LIB_DIR = path.join(prefs.RIVET_DIR, "lib")
+OBJ_CACHE_LIMIT = 1024 * 1024 * 1024 # 1 GiB
+
+def hash_tokens(tokens):
+    h = hashlib.sha1()
+    for tok in tokens:
+        h.update(f"{tok.kind.name}\0{tok.lit}\1".encode())
+    return h.hexdigest()
+
+def hash_interface(tokens, body_ranges):
+    # Function bodies are hashed separately, so editing a body only
+    # invalidates the cached result of that function.
+    h = hashlib.sha1()
+    idx = 0
+    for start, end in sorted(body_ranges):
+        if start < idx:
+            continue
+        h.update(hash_tokens(tokens[idx:start]).encode())
+        idx = end
+    h.update(hash_tokens(tokens[idx:]).encode())
+    return h.hexdigest()
+
+class CheckCache:
+    """Caches the functions that were checked without errors or warnings,
+    keyed by the token hash of their bodies.
+
+    The entries are only valid while the fingerprint of the program
+    (every token outside function bodies, the target options and the
+    compiler itself) stays the same; that covers every symbol a body
+    can reference.
+    """
+    def __init__(self, comp):
+        self.comp = comp
+        self.file = path.join(
+            CACHE_DIR, "check_" + hashlib.sha1(
+                path.abspath(comp.prefs.input).encode()
+            ).hexdigest()[:16] + ".json"
+        )
+        self.fingerprint = ""
+        self.funcs = {}
+        self.is_dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, source_files):
+        self.fingerprint = self.program_fingerprint(source_files)
+        if path.isfile(self.file):
+            try:
+                with open(self.file, encoding = "UTF-8") as f:
+                    data = json.load(f)
+                if data.get("fingerprint") == self.fingerprint:
+                    self.funcs = data["funcs"]
+            except (OSError, ValueError, KeyError):
+                self.funcs = {}
+
+    def save(self):
+        self.comp.vlog(
+            f"check cache: {self.hits} hit(s), {self.misses} miss(es)"
+        )
+        if not self.is_dirty:
+            return
+        os.makedirs(CACHE_DIR, exist_ok = True)
+        with open(self.file, "w", encoding = "UTF-8") as f:
+            json.dump({
+                "fingerprint": self.fingerprint, "funcs": self.funcs
+            }, f)
+
+    def program_fingerprint(self, source_files):
+        p = self.comp.prefs
+        h = hashlib.sha1()
+        h.update(
+            f"{utils.VERSION}|{p.get_obj_postfix()}|{p.build_mode}|{p.flags}"
+            .encode()
+        )
+        src_dir = path.dirname(path.realpath(__file__))
+        for root, _, files in os.walk(src_dir):
+            for file in sorted(files):
+                if file.endswith(".py"):
+                    mtime = os.stat(path.join(root, file)).st_mtime_ns
+                    h.update(f"{file}:{mtime}".encode())
+        for sf in sorted(source_files, key = lambda sf: sf.file):
+            h.update(f"{sf.file}:{sf.interface_hash}".encode())
+        return h.hexdigest()
+
+    def replay(self, decl):
+        # Returns `True` if `decl` can skip checking; the module variables
+        # that its body changes are marked again.
+        entry = self.funcs.get(decl.sym.qualname())
+        if entry == None or entry["body"] != decl.body_hash:
+            self.misses += 1
+            return False
+        changed_vars = []
+        for mod_name, var_name in entry["changed"]:
+            mod_sym = self.comp.universe.find(mod_name)
+            var_sym = mod_sym.find(var_name) if mod_sym else None
+            if var_sym == None:
+                self.misses += 1
+                return False
+            changed_vars.append(var_sym)
+        for var_sym in changed_vars:
+            var_sym.is_changed = True
+        self.hits += 1
+        return True
+
+    def store(self, decl, changed_vars):
+        changed = []
+        for var_sym in changed_vars:
+            mod_sym = var_sym.parent
+            if mod_sym == None or mod_sym.parent == None or not mod_sym.parent.is_universe:
+                return
+            changed.append([mod_sym.name, var_sym.name])
+        self.funcs[decl.sym.qualname()] = {
+            "body": decl.body_hash, "changed": changed
+        }
+        self.is_dirty = True
+
+class ObjCache:
+    """A content-addressed cache for the object files compiled from the
+    generated C code, in the style of ccache.
+
+    An object is named after the hash of its C source, the C compiler
+    binary, the compiler arguments and the target postfix, so a hit can be
+    linked without running the C compiler.
+    When the cache grows beyond `OBJ_CACHE_LIMIT`, the least recently used
+    objects are removed.
+    """
+    def __init__(self, comp, args):
+        self.comp = comp
+        self.args = args
+        self.compiler_id = self.compiler_fingerprint()
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def compiler_fingerprint(self):
+        cc = self.comp.prefs.target_backend_compiler
+        cc_path = shutil.which(cc) or cc
+        try:
+            st = os.stat(cc_path)
+        except OSError:
+            return cc
+        return f"{path.realpath(cc_path)}:{st.st_size}:{st.st_mtime_ns}"
+
+    def object_file(self, unit_name, source_hash):
+        # `source_hash` is the hash of the C source of the unit
+        h = hashlib.sha1()
+        h.update(
+            f"{utils.VERSION}|{self.compiler_id}|{' '.join(self.args)}|{unit_name}|{source_hash}"
+            .encode()
+        )
+        return path.join(
+            OBJ_DIR, f"{h.hexdigest()}_{self.comp.prefs.get_obj_postfix()}.o"
+        )
+
+    def lookup(self, obj_file):
+        # Returns `True` if `obj_file` is cached.
+        if self.use(obj_file):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def use(self, file):
+        # Marks `file` as used by this build; its modification time is the
+        # time of last use for `trim`.
+        self.used.add(file)
+        if not path.isfile(file):
+            return False
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        return True
+
+    def entries(self):
+        # the objects, the runtime archives built from them and the
+        # precompiled preludes
+        entries = []
+        for dir, prefix, exts in (
+            (OBJ_DIR, "", (".o", )), (LIB_DIR, "libcore_", (".a", )),
+            (LIB_DIR, "prelude_", (".h", ".h.gch"))
+        ):
+            for file in os.listdir(dir):
+                if file.startswith(prefix) and file.endswith(exts):
+                    file = path.join(dir, file)
+                    st = os.stat(file)
+                    entries.append((st.st_mtime_ns, st.st_size, file))
+        return entries
+
+    def trim(self):
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total_size <= OBJ_CACHE_LIMIT:
+                break
+            elif file in self.used:
+                continue
+            try:
+                os.remove(file)
+            except OSError:
+                continue
+            total_size -= size
+            self.evicted += 1
+
+    def summary(self):
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        return [
+            f"{self.hits} hit(s), {self.misses} miss(es), {self.evicted} evicted",
+            f"{len(entries)} file(s), {total_size / (1024 * 1024):.1f} MiB used of {OBJ_CACHE_LIMIT // (1024 * 1024)} MiB"
+        ]
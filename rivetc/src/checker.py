@@ -25,6 +25,9 @@ class Checker:
         self.defer_stmts = []
         self.defer_stmts_start = 0
 
+        # module variables changed by the current function, see `cache.py`
+        self.changed_vars = []
+
     def check_global_vars(self, decls):
         for decl in decls:
             old_sym = self.sym
@@ -195,10 +198,16 @@ class Checker:
                     "this is because Rivet cannot ensure that the function does not always return `none`"
                 )
             self.cur_func = decl.sym
-            self.check_stmts(decl.stmts)
-            decl.defer_stmts = self.defer_stmts
-            self.defer_stmts = []
-            self.check_mut_vars(decl.scope)
+            check_cache = self.comp.check_cache
+            if not (check_cache and decl.has_body and check_cache.replay(decl)):
+                errors, warns = report.ERRORS, report.WARNS
+                self.changed_vars = []
+                self.check_stmts(decl.stmts)
+                decl.defer_stmts = self.defer_stmts
+                self.defer_stmts = []
+                self.check_mut_vars(decl.scope)
+                if check_cache and decl.has_body and report.ERRORS == errors and report.WARNS == warns:
+                    check_cache.store(decl, self.changed_vars)
         elif isinstance(decl, ast.TestDecl):
             old_cur_func = self.cur_func
             self.cur_func = None
@@ -2002,6 +2011,7 @@ class Checker:
                     f"cannot use variable `{sy.name}` as mutable value", pos
                 )
             sy.is_changed = True
+            self.changed_vars.append(sy)
 
     def check_mut_vars(self, sc):
         for obj in sc.objects:
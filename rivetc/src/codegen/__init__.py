@@ -2,14 +2,14 @@
 # Use of this source code is governed by an MIT license that can
 # be found in the LICENSE file.
 
-import os
+import os, hashlib
 
 from ..sym import TypeKind
 from .. import ast, sym, type, token, prefs, report, utils
 from ..token import Kind, OVERLOADABLE_OPERATORS_STR, NO_POS
 
 from .c import CGen
-from . import ir, cg_utils
+from . import ir, cg_utils, opt, prune
 
 class TestInfo:
     def __init__(self, name, func):
@@ -36,7 +36,14 @@ class Codegen:
         self.inside_selector_expr = False
         self.inside_lhs_assign = False
 
-        self.generated_string_literals = {}
+        # the `for` loops being generated and whether their iterables are
+        # invariant, see `index_in_bounds`
+        self.counted_loops = []
+        self.removed_bounds_checks = 0
+
+        self.generated_string_literals = {} # literal -> global name
+        self.generated_empty_slice = False
+        self.string_literal_names = set()
         self.generated_tuple_types = []
         self.generated_opt_res_types = []
         self.generated_array_returns = []
@@ -60,7 +67,8 @@ class Codegen:
             )
         )
 
-        # generate 'init_string_lits_fn' function
+        # generate 'init_string_lits_fn' function; the string literals are
+        # initialized statically, it is only kept for the runtime
         self.init_string_lits_fn = ir.FuncDecl(
             False, ast.Attributes(), False, "_R4core16init_string_litsF", [],
             False, ir.VOID_T, False
@@ -83,7 +91,12 @@ class Codegen:
 
         for source_file in source_files:
             self.source_file = source_file
+            decls_nr = len(self.out_rir.decls)
             self.gen_decls(source_file.decls)
+            mod_name = source_file.sym.qualname()
+            for decl in self.out_rir.decls[decls_nr:]:
+                if isinstance(decl, ir.FuncDecl):
+                    decl.mod_name = mod_name
 
         # generate 'main' fn
         argc = ir.Ident(ir.C_INT_T, "_argc")
@@ -184,6 +197,33 @@ class Codegen:
         self.out_rir.decls.append(main_fn)
 
         if report.ERRORS == 0:
+            self.comp.vlog("pruning unreachable code...")
+            # the runtime is kept whole, its C code does not depend on the
+            # program that uses it, see `CGen`
+            stats = prune.prune_unreachable(
+                self.out_rir, lambda decl: isinstance(decl, ir.FuncDecl)
+                and cg_utils.is_runtime_module(decl.mod_name)
+            )
+            self.comp.vlog(
+                f"bounds checks removed: {self.removed_bounds_checks}"
+            )
+            if self.comp.prefs.show_stats:
+                for line in stats.summary():
+                    utils.eprint(f"rivetc: stats: {line}")
+                utils.eprint(
+                    f"rivetc: stats: bounds checks: {self.removed_bounds_checks} removed"
+                )
+            if len(self.comp.prefs.opt_passes) > 0:
+                self.comp.vlog(
+                    f"running optimization passes: {', '.join(self.comp.prefs.opt_passes)}..."
+                )
+                before, after = opt.PassManager(
+                    self.comp, self.comp.prefs.opt_passes
+                ).run(self.out_rir)
+                if self.comp.prefs.show_stats:
+                    utils.eprint(
+                        f"rivetc: stats: instructions: {before} before optimization, {after} after"
+                    )
             if self.comp.prefs.emit_rir:
                 self.comp.vlog("generating RIR output (with --emit-rir)...")
                 with open(f"{self.comp.prefs.mod_name}.rir", "w") as f:
@@ -262,12 +302,18 @@ class Codegen:
                 is_extern = decl.is_extern and decl.abi != sym.ABI.Rivet
                 name = l.name if is_extern else cg_utils.mangle_symbol(l.sym)
                 typ = self.ir_type(l.typ)
-                self.out_rir.globals.append(
-                    ir.GlobalVar(is_extern, is_extern, typ, name)
-                )
+                global_var = ir.GlobalVar(is_extern, is_extern, typ, name)
+                self.out_rir.globals.append(global_var)
                 if not decl.is_extern:
                     ident = ir.Ident(typ, name)
                     self.cur_func = self.init_global_vars_fn
+                    if len(decl.lefts) == 1 and self.is_scalar_type(l.typ):
+                        if lit := self.comp.const_eval.eval(decl.right, l.typ):
+                            # use a static initializer instead
+                            global_var.value = self.gen_expr_with_cast(
+                                l.typ, lit
+                            )
+                            continue
                     value = self.gen_expr_with_cast(l.typ, decl.right)
                     if isinstance(typ, ir.Array):
                         size, _ = self.comp.type_size(l.typ)
@@ -411,6 +457,32 @@ class Codegen:
             else:
                 idx_name = self.cur_func.local_name()
             iterable = self.gen_expr(stmt.iterable)
+            value_t_ir = self.ir_type(iterable_sym.info.elem_typ)
+            value_t_is_boxed = isinstance(
+                value_t_ir, ir.Pointer
+            ) and value_t_ir.is_managed
+            is_invariant = self.iterable_is_invariant(stmt)
+            if is_invariant:
+                # `ptr` and `len` are read once, and the address of the
+                # elements is moved forward in each iteration
+                len_ = ir.Ident(ir.UINT_T, self.cur_func.local_name())
+                self.cur_func.inline_alloca(
+                    len_.typ, len_.name,
+                    ir.Selector(ir.UINT_T, iterable, ir.Name("len"))
+                )
+                elem_ptr = ir.Ident(
+                    value_t_ir.ptr(value_t_is_boxed), self.cur_func.local_name()
+                )
+                self.cur_func.inline_alloca(
+                    elem_ptr.typ, elem_ptr.name,
+                    ir.Inst(
+                        ir.InstKind.Cast, [
+                            ir.Selector(
+                                ir.RAWPTR_T, iterable, ir.Name("ptr")
+                            ), elem_ptr.typ
+                        ]
+                    )
+                )
             self.cur_func.inline_alloca(
                 ir.UINT_T, idx_name, ir.IntLit(ir.UINT_T, "0")
             )
@@ -418,22 +490,20 @@ class Codegen:
             self.cur_func.add_label(self.loop_entry_label)
             if iterable_sym.kind == TypeKind.Array:
                 len_ = ir.IntLit(ir.UINT_T, iterable_sym.info.size.lit)
-            else:
+            elif not is_invariant:
                 len_ = ir.Selector(ir.UINT_T, iterable, ir.Name("len"))
             self.cur_func.add_cond_br(
                 ir.Inst(ir.InstKind.Cmp, [ir.Name("<"), idx, len_]), body_label,
                 self.loop_exit_label
             )
             self.cur_func.add_label(body_label)
-            value_t_ir = self.ir_type(iterable_sym.info.elem_typ)
             value_is_ref_or_is_mut = stmt.value.is_ref or stmt.value.is_mut
-            value_t_is_boxed = isinstance(
-                value_t_ir, ir.Pointer
-            ) and value_t_ir.is_managed
             if iterable_sym.kind == TypeKind.Array:
                 value = ir.Inst(
                     ir.InstKind.GetElementPtr, [iterable, idx], value_t_ir
                 )
+            elif is_invariant:
+                value = elem_ptr
             else:
                 value = ir.Selector(ir.RAWPTR_T, iterable, ir.Name("ptr"))
                 value = ir.Inst(
@@ -455,8 +525,12 @@ class Codegen:
             unique_ir_name = self.cur_func.unique_name(stmt.value.name)
             self.cur_func.inline_alloca(value_t_ir, unique_ir_name, value)
             stmt.scope.update_ir_name(stmt.value.name, unique_ir_name)
+            if is_invariant:
+                self.cur_func.add_inst(ir.Inst(ir.InstKind.Inc, [elem_ptr]))
             self.while_continue_expr = ir.Inst(ir.InstKind.Inc, [idx])
+            self.counted_loops.append((stmt, is_invariant))
             self.gen_stmt(stmt.stmt)
+            self.counted_loops.pop()
             self.cur_func.add_inst(self.while_continue_expr)
             self.cur_func.add_br(self.loop_entry_label)
             self.cur_func.add_label(self.loop_exit_label)
@@ -648,7 +722,10 @@ class Codegen:
             variant_idx = expr_sym.info.get_variant_by_type(expected_typ_).value
             self.cur_func.add_call(
                 "_R4core16tagged_enum_castF", [
-                    ir.Selector(ir.UINT_T, res_expr, ir.Name("_idx_")),
+                    ir.Selector(
+                        self.enum_tag_ir_type(expr_sym), res_expr,
+                        ir.Name("_idx_")
+                    ),
                     variant_idx
                 ]
             )
@@ -734,9 +811,7 @@ class Codegen:
                         for b in list(utils.bytestr(escaped_val).buf)
                     ]
                 )
-            size = utils.bytestr(expr.lit).len
-            if not expr.is_raw:
-                size -= expr.lit.count("\\") - expr.lit.count("\\\\")
+            size = self.string_literal_size(expr.lit, expr.is_raw)
             if expr.typ == self.comp.string_t:
                 return self.gen_string_literal(escaped_val, size)
             return ir.StringLit(escaped_val, str(size))
@@ -978,6 +1053,24 @@ class Codegen:
                         self.cur_func.store(left, value)
             else:
                 single_op = expr.op.single()
+                if single_op == Kind.Plus and expr.left.typ == self.comp.string_t:
+                    # `s += a + b` appends both operands with a single call
+                    current = ir.Inst(
+                        ir.InstKind.LoadPtr, [left]
+                    ) if require_store_ptr else left
+                    if self.comp.prefs.fuse_string_concat:
+                        operands = self.concat_operands(expr.right)
+                    else:
+                        operands = [expr.right]
+                    value = self.concat_strings([current] + [
+                        self.gen_expr_with_cast(self.comp.string_t, operand)
+                        for operand in operands
+                    ])
+                    if require_store_ptr:
+                        self.cur_func.store_ptr(left, value)
+                    else:
+                        self.cur_func.store(left, value)
+                    return ir.Skip()
                 right = self.gen_expr_with_cast(expr.left.typ, expr.right)
                 if expr_left_sym.kind == TypeKind.Struct and expr_left_sym.exists(
                     str(single_op)
@@ -1146,6 +1239,10 @@ class Codegen:
             is_vtable_call = False
             if not expr.sym:
                 raise Exception(f"expr.sym is `None` [ {expr} ] at {expr.pos}")
+            if self.comp.prefs.lower_fmt_literals and (
+                res := self.gen_literal_fmt_call(expr, custom_tmp)
+            ):
+                return res
             if expr.sym.is_method:
                 left_sym = expr.sym.self_typ.symbol()
                 left2_sym = expr.left.left.typ.symbol()
@@ -1156,54 +1253,13 @@ class Codegen:
                     is_vtable_call = True
                     if not isinstance(self_expr.typ, ir.Pointer):
                         self_expr = ir.Inst(ir.InstKind.LoadPtr, [self_expr])
-                    if left_sym.kind == TypeKind.Trait:
-                        if left2_sym.kind == TypeKind.Trait and left_sym != left2_sym:
-                            id_value = ir.Inst(
-                                ir.InstKind.Call, [
-                                    ir.Name(
-                                        f"{cg_utils.mangle_symbol(left_sym)}17__index_of_vtbl__"
-                                    ),
-                                    ir.Selector(
-                                        ir.UINT_T, self_expr, ir.Name("_idx_")
-                                    )
-                                ]
-                            )
-                        else:
-                            id_value = ir.Selector(
-                                ir.UINT_T, self_expr, ir.Name("_id_")
-                            )
-                    else:
-                        id_value = ir.Inst(
-                            ir.InstKind.Call, [
-                                ir.Name(
-                                    f"{cg_utils.mangle_symbol(left_sym)}17__index_of_vtbl__"
-                                ),
-                                ir.Selector(
-                                    ir.UINT_T, self_expr, ir.Name("_idx_")
-                                )
-                            ]
-                        )
                     args.append(
-                        ir.Selector(
-                            ir.RAWPTR_T,
-                            ir.Inst(
-                                ir.InstKind.LoadPtr, [
-                                    ir.Inst(
-                                        ir.InstKind.Add, [
-                                            ir.Name(
-                                                cg_utils
-                                                .mangle_symbol(left_sym) +
-                                                "4VTBL"
-                                            ), id_value
-                                        ]
-                                    )
-                                ]
-                            ),
-                            ir.Name(
-                                OVERLOADABLE_OPERATORS_STR[expr.sym.name]
-                                if expr.sym.name in
-                                OVERLOADABLE_OPERATORS_STR else expr.sym.name
-                            )
+                        self.vtable_method(
+                            left_sym, self_expr,
+                            OVERLOADABLE_OPERATORS_STR[expr.sym.name]
+                            if expr.sym.name in OVERLOADABLE_OPERATORS_STR else
+                            expr.sym.name, left2_sym.kind == TypeKind.Trait
+                            and left_sym != left2_sym
                         )
                     )
                     if left_sym.kind == TypeKind.Trait and not expr.sym.has_body:
@@ -1519,10 +1575,10 @@ class Codegen:
                     value = left
                 else:
                     self.cur_func.add_cond_br(
-                        ir.Selector(ir.BOOL_T, left, ir.Name("is_none")),
-                        panic_l, exit_l
+                        self.option_is_none(expr.left_typ, left), panic_l,
+                        exit_l
                     )
-                    value = ir.Selector(ir_typ, left, ir.Name("value"))
+                    value = self.option_unwrap(expr.left_typ, left)
                 self.cur_func.add_label(panic_l)
                 self.runtime_error(f"attempt to use none value (`{expr.left}`)")
                 self.cur_func.add_label(exit_l)
@@ -1686,7 +1742,12 @@ class Codegen:
                 self.cur_func.inline_alloca(self.ir_type(expr.typ), tmp, inst)
                 return ir.Ident(self.ir_type(expr.typ), tmp)
             idx = self.gen_expr(expr.index)
-            if isinstance(s.info, sym.ArrayInfo):
+            in_bounds = not isinstance(
+                expr.left_typ, type.Ptr
+            ) and self.index_in_bounds(expr)
+            if in_bounds:
+                self.removed_bounds_checks += 1
+            elif isinstance(s.info, sym.ArrayInfo):
                 self.cur_func.add_call(
                     "_R4core11array_indexF",
                     [ir.IntLit(ir.UINT_T, s.info.size.lit), idx]
@@ -1716,13 +1777,28 @@ class Codegen:
                         )
                     if expr.is_ref:
                         expr_typ_ir = expr_typ_ir.ptr()
-                value = ir.Inst(
-                    ir.InstKind.Cast, [
-                        ir.Inst(
-                            ir.InstKind.Call, [ir.Name(method_name), left, idx]
-                        ), expr_typ_ir2
-                    ], expr_typ_ir2
-                )
+                if in_bounds:
+                    # like the elements of `for` loops
+                    value = ir.Inst(
+                        ir.InstKind.Add, [
+                            ir.Inst(
+                                ir.InstKind.Cast, [
+                                    ir.Selector(
+                                        ir.RAWPTR_T, left, ir.Name("ptr")
+                                    ), expr_typ_ir2
+                                ], expr_typ_ir2
+                            ), idx
+                        ], expr_typ_ir2
+                    )
+                else:
+                    value = ir.Inst(
+                        ir.InstKind.Cast, [
+                            ir.Inst(
+                                ir.InstKind.Call,
+                                [ir.Name(method_name), left, idx]
+                            ), expr_typ_ir2
+                        ], expr_typ_ir2
+                    )
                 load_ptr = True
                 if self.inside_lhs_assign and self.inside_selector_expr:
                     if not s.info.elem_typ.symbol().is_boxed():
@@ -1767,7 +1843,7 @@ class Codegen:
                             ir.InstKind.Cmp,
                             [op, left, ir.NoneLit(ir.RAWPTR_T)], ir.BOOL_T
                         )
-                    val = ir.Selector(ir.BOOL_T, left, ir.Name("is_none"))
+                    val = self.option_is_none(expr_left_typ, left)
                     if expr.op == Kind.Ne:
                         val = ir.Inst(ir.InstKind.BooleanNot, [val], ir.BOOL_T)
                     return val
@@ -1786,7 +1862,7 @@ class Codegen:
                              ir.NoneLit(ir.RAWPTR_T)]
                         )
                     else:
-                        cond = ir.Selector(ir.BOOL_T, left, ir.Name("is_none"))
+                        cond = self.option_is_none(expr_typ, left)
                     tmp = self.stacked_instance(self.ir_type(expr_typ.typ))
                     self.cur_func.add_cond_br(
                         cond, is_none_label, is_not_none_label
@@ -1801,8 +1877,7 @@ class Codegen:
                         self.cur_func.store(tmp, left)
                     else:
                         self.cur_func.store(
-                            tmp,
-                            ir.Selector(expr_typ.typ, left, ir.Name("value"))
+                            tmp, self.option_unwrap(expr_typ, left)
                         )
                     if is_not_never:
                         self.cur_func.add_label(exit_label)
@@ -1835,7 +1910,10 @@ class Codegen:
                         cmp = ir.Inst(
                             ir.InstKind.Cmp, [
                                 ir.Name(kind),
-                                ir.Selector(ir.UINT_T, left, ir.Name("_idx_")),
+                                ir.Selector(
+                                    self.enum_tag_ir_type(left_sym), left,
+                                    ir.Name("_idx_")
+                                ),
                                 ir.IntLit(
                                     ir.UINT_T,
                                     str(expr.right.variant_info.value)
@@ -2034,6 +2112,13 @@ class Codegen:
                 self.cur_func.inline_alloca(ir.BOOL_T, tmp, call)
                 return ir.Ident(ir.BOOL_T, tmp)
 
+            if expr.op == Kind.Plus and expr_left_typ == self.comp.string_t:
+                if self.comp.prefs.fuse_string_concat:
+                    operands = self.concat_operands(expr)
+                else:
+                    operands = [expr.left, expr.right]
+                return self.gen_string_concat(operands)
+
             left = self.gen_expr_with_cast(expr_left_typ, expr.left)
             right = self.gen_expr_with_cast(expr_left_typ, expr.right)
 
@@ -2189,6 +2274,11 @@ class Codegen:
                 )
             else:
                 match_expr = self.gen_expr_with_cast(expr.expr.typ, expr.expr)
+                if cases := self.match_switch_cases(expr):
+                    self.gen_match_switch(expr, match_expr, tmp, exit_match, cases)
+                    if not is_void_value:
+                        return tmp
+                    return ir.Skip()
             for b in expr.branches:
                 is_branch_void_value = b.typ in self.void_types
                 b_label = "" if b.is_else else self.cur_func.local_name()
@@ -2202,24 +2292,8 @@ class Codegen:
                     ) if i < len(b.pats) - 1 else b_exit
                     tmp2 = self.cur_func.local_name()
                     if expr.is_typematch:
-                        if p.typ.sym.kind == TypeKind.Trait:
-                            value_idx_x = ir.IntLit(
-                                ir.UINT_T,
-                                str(
-                                    expr.expected_typ.symbol().indexof(
-                                        p.typ.sym
-                                    )
-                                )
-                            )
-                        elif p.typ.sym.kind == TypeKind.Enum:
-                            value_idx_x = ir.IntLit(
-                                ir.UINT_T, str(p.variant_info.value)
-                            )
-                        else:
-                            value_idx_x = ir.IntLit(
-                                ir.UINT_T, str(p.typ.sym.id)
-                            )
-                        if p.typ.sym.kind == TypeKind.Enum and not p.typ.sym.info.is_tagged:
+                        field, value_idx_x = self.typematch_key(expr, p)
+                        if field == None:
                             self.cur_func.inline_alloca(
                                 ir.BOOL_T, tmp2,
                                 ir.Inst(
@@ -2235,58 +2309,13 @@ class Codegen:
                                         ir.Name("=="),
                                         ir.Selector(
                                             self.ir_type(expr.expr.typ),
-                                            match_expr,
-                                            ir.Name(
-                                                "_id_" if p.typ.sym.kind ==
-                                                TypeKind.Trait else "_idx_"
-                                            )
+                                            match_expr, ir.Name(field)
                                         ), value_idx_x
                                     ]
                                 )
                             )
                         if b.has_var:
-                            var_t = self.ir_type(b.var_typ)
-                            var_t2 = var_t.ptr(
-                            ) if not isinstance(var_t, ir.Pointer) else var_t
-                            e_expr_typ_sym = expr.expr.typ.symbol()
-                            if e_expr_typ_sym.kind == TypeKind.Enum:
-                                obj_f = ir.Selector(
-                                    e_expr_typ_sym.name + "6_Union", match_expr,
-                                    ir.Name("obj")
-                                )
-                                val = ir.Selector(
-                                    self.ir_type(p.variant_info.typ), obj_f,
-                                    ir.Name(f"v{p.variant_info.value}")
-                                )
-                                if b.var_is_ref:
-                                    val = ir.Inst(ir.InstKind.GetPtr, [val])
-                                elif b.var_is_mut and not isinstance(
-                                    var_t, ir.Pointer
-                                ):
-                                    val = ir.Inst(ir.InstKind.GetPtr, [val])
-                            else:
-                                val = ir.Inst(
-                                    ir.InstKind.Cast, [
-                                        ir.Selector(
-                                            ir.RAWPTR_T, match_expr,
-                                            ir.Name("obj")
-                                        ), var_t
-                                    ]
-                                )
-                                if not (
-                                    b.var_is_mut or (
-                                        isinstance(var_t, ir.Pointer)
-                                        and var_t.is_managed
-                                    )
-                                ):
-                                    val = ir.Inst(ir.InstKind.LoadPtr, [val])
-                            if b.var_is_mut and not isinstance(
-                                var_t, ir.Pointer
-                            ):
-                                var_t = var_t.ptr(True)
-                            unique_name = self.cur_func.unique_name(b.var_name)
-                            b.scope.update_ir_name(b.var_name, unique_name)
-                            self.cur_func.inline_alloca(var_t, unique_name, val)
+                            self.gen_match_branch_var(expr, b, p, match_expr)
                     else:
                         p_typ_sym = p.typ.symbol()
                         tmp2_i = ir.Ident(ir.BOOL_T, tmp2)
@@ -2543,21 +2572,177 @@ class Codegen:
             self.gen_expr(defer_stmt.expr)
             self.cur_func.add_label(defer_end)
 
-    def gen_const(self, const_sym):
-        if const_sym.has_evaled_expr:
-            const_sym.has_ir_expr = True
-            const_sym.ir_expr = self.gen_expr_with_cast(
-                const_sym.typ, const_sym.evaled_expr
+    def typematch_key(self, expr, p):
+        # Returns the field of the matched value compared with the pattern
+        # type `p` (`None` for the value itself) and the compared value.
+        if p.typ.sym.kind == TypeKind.Trait:
+            value_idx_x = ir.IntLit(
+                ir.UINT_T, str(expr.expected_typ.symbol().indexof(p.typ.sym))
             )
-            return const_sym.ir_expr
+        elif p.typ.sym.kind == TypeKind.Enum:
+            value_idx_x = ir.IntLit(ir.UINT_T, str(p.variant_info.value))
+        else:
+            value_idx_x = ir.IntLit(ir.UINT_T, str(p.typ.sym.id))
+        if p.typ.sym.kind == TypeKind.Enum and not p.typ.sym.info.is_tagged:
+            return None, value_idx_x
+        return "_id_" if p.typ.sym.kind == TypeKind.Trait else "_idx_", value_idx_x
+
+    def gen_match_branch_var(self, expr, b, p, match_expr):
+        var_t = self.ir_type(b.var_typ)
+        e_expr_typ_sym = expr.expr.typ.symbol()
+        if e_expr_typ_sym.kind == TypeKind.Enum:
+            obj_f = ir.Selector(
+                e_expr_typ_sym.name + "6_Union", match_expr, ir.Name("obj")
+            )
+            val = ir.Selector(
+                self.ir_type(p.variant_info.typ), obj_f,
+                ir.Name(f"v{p.variant_info.value}")
+            )
+            if b.var_is_ref:
+                val = ir.Inst(ir.InstKind.GetPtr, [val])
+            elif b.var_is_mut and not isinstance(var_t, ir.Pointer):
+                val = ir.Inst(ir.InstKind.GetPtr, [val])
+        else:
+            val = ir.Inst(
+                ir.InstKind.Cast, [
+                    ir.Selector(ir.RAWPTR_T, match_expr, ir.Name("obj")), var_t
+                ]
+            )
+            if not (
+                b.var_is_mut
+                or (isinstance(var_t, ir.Pointer) and var_t.is_managed)
+            ):
+                val = ir.Inst(ir.InstKind.LoadPtr, [val])
+        if b.var_is_mut and not isinstance(var_t, ir.Pointer):
+            var_t = var_t.ptr(True)
+        unique_name = self.cur_func.unique_name(b.var_name)
+        b.scope.update_ir_name(b.var_name, unique_name)
+        self.cur_func.inline_alloca(var_t, unique_name, val)
+
+    def match_switch_cases(self, expr):
+        # Returns the field of the matched value used to select the branch
+        # (`None` for the value itself) and the case values of each branch,
+        # if all the patterns are constants or types and the branches have
+        # no conditions, so `expr` can be generated as a `switch`.
+        fields = set()
+        cases = []
+        for b in expr.branches:
+            if b.is_else:
+                continue
+            if b.has_cond or (b.has_var and len(b.pats) > 1):
+                return None
+            values = []
+            for p in b.pats:
+                if expr.is_typematch:
+                    field, value = self.typematch_key(expr, p)
+                    fields.add(field)
+                    values.append(value.value())
+                elif (value := self.pattern_value(p)) != None:
+                    values.append(value)
+                else:
+                    return None
+            cases.append(values)
+        if len(cases) == 0 or len(fields) > 1:
+            return None
+        return (fields.pop() if len(fields) == 1 else None), cases
+
+    def pattern_value(self, p):
+        # Returns the integer value of the constant pattern `p`, or `None`.
+        try:
+            if isinstance(p, ast.EnumLiteral) and not p.is_instance:
+                return int(str(p.variant_info.value), 0)
+            elif isinstance(p, ast.SelectorExpr) and p.is_path and isinstance(
+                p.left_sym, sym.Type
+            ) and p.left_sym.kind == TypeKind.Enum:
+                if p.left_sym.info.is_tagged:
+                    return None
+                if v := p.left_sym.info.get_variant(p.field_name):
+                    return int(str(v.value), 0)
+                return None
+        except ValueError:
+            return None
+        if isinstance(p, ast.CharLiteral):
+            ch = cg_utils.decode_escape(p.lit)
+            if p.is_byte:
+                return utils.bytestr(ch).buf[0]
+            return ord(ch) if len(ch) == 1 else None
+        value = self.comp.const_eval.eval_expr(p)
+        if isinstance(value, bool):
+            return int(value)
+        elif isinstance(value, int):
+            return self.comp.const_eval.wrap(value, p.typ)
+        return None
+
+    def gen_match_switch(self, expr, match_expr, tmp, exit_match, cases):
+        # The branches are selected with a single `switch`; a value that
+        # appears in several branches selects the first one.
+        field, values = cases
+        if field == None:
+            key = match_expr
+            case_typ = match_expr.typ
+        else:
+            key = ir.Selector(ir.UINT_T, match_expr, ir.Name(field))
+            case_typ = ir.UINT_T
+        else_label = exit_match
+        labels = []
+        for b in expr.branches:
+            label = self.cur_func.local_name()
+            if b.is_else:
+                else_label = label
+            labels.append(label)
+        self.cur_func.add_comment(f"match expr switch (branches: {len(expr.branches)})")
+        switch_cases = []
+        seen = set()
+        b_values = iter(values)
+        for b, label in zip(expr.branches, labels):
+            if b.is_else:
+                continue
+            for value in next(b_values):
+                if value in seen:
+                    continue
+                seen.add(value)
+                switch_cases.append((
+                    ir.IntLit(
+                        case_typ,
+                        hex(value) if value > 0x7FFFFFFFFFFFFFFF else str(value)
+                    ), label
+                ))
+        self.cur_func.add_switch(key, else_label, switch_cases)
+        for b, label in zip(expr.branches, labels):
+            self.cur_func.add_label(label)
+            if b.has_var:
+                self.gen_match_branch_var(expr, b, b.pats[0], match_expr)
+            if b.typ in self.void_types:
+                self.gen_expr_with_cast(
+                    expr.expected_typ, b.expr
+                ) # ignore void value
+            else:
+                self.cur_func.store(
+                    tmp, self.gen_expr_with_cast(expr.expected_typ, b.expr)
+                )
+            self.cur_func.add_br(exit_match)
+        self.cur_func.add_label(exit_match)
+
+    def gen_const(self, const_sym):
         if const_sym.has_ir_expr:
             return const_sym.ir_expr
         const_sym.has_ir_expr = True
-        const_sym.ir_expr = self.gen_expr_with_cast(
-            const_sym.typ, const_sym.expr
-        )
+        if lit := self.comp.const_eval.eval_const(const_sym):
+            const_sym.ir_expr = self.gen_expr_with_cast(const_sym.typ, lit)
+        else:
+            const_sym.ir_expr = self.gen_expr_with_cast(
+                const_sym.typ, const_sym.expr
+            )
         return const_sym.ir_expr
 
+    def is_scalar_type(self, typ):
+        if not isinstance(typ, type.Type):
+            return False
+        sy = typ.symbol()
+        return sy.is_primitive() and sy.kind not in (
+            TypeKind.Void, TypeKind.None_, TypeKind.Never
+        )
+
     def result_void(self, typ):
         tmp = self.stacked_instance(self.ir_type(typ))
         self.cur_func.store(
@@ -2593,6 +2778,8 @@ class Codegen:
         return tmp
 
     def option_value(self, typ, value):
+        if self.comp.layout.option_niche(typ.typ) != None:
+            return value
         tmp = self.stacked_instance(self.ir_type(typ))
         self.cur_func.store(
             ir.Selector(ir.BOOL_T, tmp, ir.Name("is_none")),
@@ -2604,6 +2791,8 @@ class Codegen:
         return tmp
 
     def option_none(self, typ):
+        if (niche := self.comp.layout.option_niche(typ.typ)) != None:
+            return ir.IntLit(self.ir_type(typ.typ), str(niche))
         tmp = self.stacked_instance(self.ir_type(typ))
         self.cur_func.store(
             ir.Selector(ir.BOOL_T, tmp, ir.Name("is_none")),
@@ -2611,6 +2800,26 @@ class Codegen:
         )
         return tmp
 
+    def enum_tag_ir_type(self, enum_sym):
+        return self.ir_type(self.comp.layout.enum_tag_type(enum_sym))
+
+    def option_is_none(self, typ, value):
+        # `typ` is an option of a non-pointer type; the options with a niche
+        # are `none` when their value is the niche
+        if (niche := self.comp.layout.option_niche(typ.typ)) != None:
+            return ir.Inst(
+                ir.InstKind.Cmp, [
+                    ir.Name("=="), value,
+                    ir.IntLit(self.ir_type(typ.typ), str(niche))
+                ], ir.BOOL_T
+            )
+        return ir.Selector(ir.BOOL_T, value, ir.Name("is_none"))
+
+    def option_unwrap(self, typ, value):
+        if self.comp.layout.option_niche(typ.typ) != None:
+            return value
+        return ir.Selector(self.ir_type(typ.typ), value, ir.Name("value"))
+
     def runtime_error(self, msg):
         self.cur_func.add_call(
             "_R4core13runtime_errorF", [
@@ -2620,18 +2829,300 @@ class Codegen:
         )
 
     def variadic_args(self, vargs, var_arg_typ_):
-        if len(vargs) == 0:
-            return self.empty_dyn_array(var_arg_typ_.typ.symbol())
+        # The slice points to the arguments in the stack of the caller, like
+        # `Slice.from_array`, but it is built in place, without a call.
         elem_size, _ = self.comp.type_size(var_arg_typ_)
-        return ir.Inst(
-            ir.InstKind.Call, [
-                ir.Name("_R4core5Slice10from_arrayF"),
-                ir.ArrayLit(self.ir_type(var_arg_typ_), vargs),
-                ir.IntLit(ir.UINT_T, str(elem_size)),
-                ir.IntLit(ir.UINT_T, str(len(vargs)))
+        return ir.StructLit(
+            ir.SLICE_T, [
+                ("ptr", ir.ArrayLit(self.ir_type(var_arg_typ_), vargs)),
+                ("elem_size", ir.IntLit(ir.UINT_T, str(elem_size))),
+                ("len", ir.IntLit(ir.UINT_T, str(len(vargs))))
             ]
         )
 
+    def concat_operands(self, expr):
+        # Flattens a chain of `string` concatenations, like `a + b + c`, into
+        # its operands; adjacent string literals are joined, if they can be.
+        if isinstance(expr, ast.ParExpr):
+            return self.concat_operands(expr.expr)
+        if not (
+            isinstance(expr, ast.BinaryExpr) and expr.op == Kind.Plus
+            and expr.left.typ == self.comp.string_t
+        ):
+            return [expr]
+        operands = self.concat_operands(expr.left)
+        for operand in self.concat_operands(expr.right):
+            prev = operands[-1]
+            if cg_utils.can_join_string_literals(prev, operand):
+                lit = ast.StringLiteral(
+                    prev.lit + operand.lit, False, False, False, prev.pos
+                )
+                lit.typ = self.comp.string_t
+                operands[-1] = lit
+            else:
+                operands.append(operand)
+        return operands
+
+    def gen_string_concat(self, operands):
+        return self.concat_strings([
+            self.gen_expr_with_cast(self.comp.string_t, operand)
+            for operand in operands
+        ])
+
+    def concat_strings(self, values):
+        # A chain of concatenations is a single call to `string.concat`, which
+        # allocates the result once, instead of a call to `string.+` (and an
+        # intermediate string) for each `+`.
+        if len(values) == 1:
+            return values[0]
+        if len(values) == 2:
+            args = [ir.Name("_R4core6string5_add_M"), values[0], values[1]]
+        else:
+            args = [
+                ir.Name("_R4core6string6concatM"), values[0],
+                self.variadic_args(values[1:], self.comp.string_t)
+            ]
+        tmp = ir.Ident(
+            self.ir_type(self.comp.string_t), self.cur_func.local_name()
+        )
+        self.cur_func.inline_alloca(
+            tmp.typ, tmp.name, ir.Inst(ir.InstKind.Call, args)
+        )
+        return tmp
+
+    def gen_literal_fmt_call(self, expr, custom_tmp):
+        # Formats the literal format strings of `string.fmt`, `console_write`
+        # and `console_writeln` calls at compile time: the text and the
+        # arguments are written to a `StringBuilder`, the strings and numbers
+        # directly and the other values with `Stringable.to_string`. Returns
+        # `None` if `expr` is not such a call, or if its format string is
+        # invalid, which is left to the runtime formatter to report.
+        if expr.has_spread_expr or not expr.sym.is_variadic:
+            return None
+        if expr.sym.is_method:
+            if expr.sym.name != "fmt" or expr.sym.self_typ != self.comp.string_t:
+                return None
+            fmt_expr = expr.left.left
+            args = expr.args
+        elif expr.sym.parent and expr.sym.parent.is_core_mod(
+        ) and expr.sym.name in ("console_write", "console_writeln"):
+            if len(expr.args) == 0 or expr.args[0].is_named:
+                return None
+            fmt_expr = expr.args[0].expr
+            args = expr.args[1:]
+        else:
+            return None
+        if not isinstance(
+            fmt_expr, ast.StringLiteral
+        ) or fmt_expr.is_bytestr or fmt_expr.is_cstr:
+            return None
+        if len(args) == 0:
+            # `string.fmt` returns the string as is, braces included
+            pieces = [fmt_expr.lit]
+        else:
+            pieces = cg_utils.parse_fmt_literal(
+                fmt_expr.lit, fmt_expr.is_raw, len(args)
+            )
+            if pieces == None:
+                return None
+        var_arg_typ = expr.sym.args[-1].typ.typ
+        values = []
+        for i, arg in enumerate(args):
+            typ = self.comp.comptime_number_to_type(arg.expr.typ)
+            if arg.typ == var_arg_typ:
+                # e.g. the branches of `if` and `match` expressions are
+                # checked, and boxed, as the trait
+                typ = var_arg_typ
+            if typ == self.comp.string_t or self.comp.is_number(typ):
+                value = self.gen_expr_with_cast(typ, arg.expr)
+            else:
+                value = self.gen_expr_with_cast(var_arg_typ, arg.expr)
+            if not isinstance(value, ir.Ident) or not all(
+                self.is_plain_load(later.expr) for later in args[i + 1:]
+            ):
+                # the arguments are evaluated once, in order: variables are
+                # copied too, as a later argument can assign to them
+                tmp = ir.Ident(self.ir_type(typ), self.cur_func.local_name())
+                if typ != self.comp.string_t and not self.comp.is_number(typ):
+                    tmp.typ = self.ir_type(var_arg_typ)
+                self.cur_func.inline_alloca(tmp.typ, tmp.name, value)
+                value = tmp
+            values.append((value, typ))
+        if all(isinstance(piece, str) for piece in pieces):
+            res = self.gen_fmt_text("".join(pieces), fmt_expr.is_raw)
+        else:
+            sb = ir.Ident(
+                ir.Type("_R4core13StringBuilder").ptr(True),
+                self.cur_func.local_name()
+            )
+            cap = 0
+            for piece in pieces:
+                if isinstance(piece, str):
+                    cap += self.string_literal_size(piece, fmt_expr.is_raw)
+                elif piece[1] != None:
+                    cap += abs(piece[1])
+                elif self.comp.is_number(values[piece[0]][1]):
+                    cap += 20
+            self.cur_func.inline_alloca(
+                sb.typ, sb.name,
+                ir.Inst(
+                    ir.InstKind.Call, [
+                        ir.Name("_R4core13StringBuilder3newF"),
+                        ir.IntLit(ir.UINT_T, str(cap))
+                    ]
+                )
+            )
+            for piece in pieces:
+                if isinstance(piece, str):
+                    self.cur_func.add_call(
+                        "_R4core13StringBuilder5writeM",
+                        [sb, self.gen_fmt_text(piece, fmt_expr.is_raw)]
+                    )
+                    continue
+                value, typ = values[piece[0]]
+                width = piece[1]
+                if width == None and self.comp.is_number(typ):
+                    if self.comp.is_signed_int(typ):
+                        name, ir_typ = "9write_int", self.ir_type(self.comp.int64_t)
+                    elif self.comp.is_unsigned_int(typ):
+                        name, ir_typ = "10write_uint", ir.UINT64_T
+                    else:
+                        name, ir_typ = "11write_float", ir.Float64_T
+                    self.cur_func.add_call(
+                        f"_R4core13StringBuilder{name}M",
+                        [sb, ir.Inst(ir.InstKind.Cast, [value, ir_typ], ir_typ)]
+                    )
+                    continue
+                if typ != self.comp.string_t:
+                    if self.comp.is_number(typ):
+                        value = self.trait_value(value, typ, var_arg_typ)
+                    value = self.stringable_to_string(value, var_arg_typ)
+                if width == None:
+                    self.cur_func.add_call(
+                        "_R4core13StringBuilder5writeM", [sb, value]
+                    )
+                else:
+                    self.cur_func.add_call(
+                        "_R4core13StringBuilder12write_paddedM",
+                        [sb, value, ir.IntLit(ir.INT_T, str(width))]
+                    )
+            res = ir.Ident(ir.STRING_T.ptr(True), self.cur_func.local_name())
+            self.cur_func.inline_alloca(
+                res.typ, res.name,
+                ir.Inst(
+                    ir.InstKind.Call,
+                    [ir.Name("_R4core13StringBuilder9to_stringM"), sb]
+                )
+            )
+        if expr.sym.name == "console_writeln":
+            self.cur_func.add_call(
+                "_R4core13writeln_to_fdF", [ir.IntLit(self.ir_type(self.comp.int32_t), "1"), res]
+            )
+            return ir.Skip()
+        elif expr.sym.name == "console_write":
+            self.cur_func.add_call(
+                "_R4core15write_buf_to_fdF", [
+                    ir.IntLit(self.ir_type(self.comp.int32_t), "1"),
+                    ir.Selector(ir.UINT8_T.ptr(), res, ir.Name("ptr")),
+                    ir.Selector(ir.UINT_T, res, ir.Name("len"))
+                ]
+            )
+            return ir.Skip()
+        if custom_tmp:
+            self.cur_func.store(custom_tmp, res)
+            return custom_tmp
+        return res
+
+    def is_plain_load(self, expr):
+        # `expr` only reads a variable or a literal, so it cannot change
+        # the value of another argument
+        if isinstance(expr, ast.ParExpr):
+            return self.is_plain_load(expr.expr)
+        return isinstance(
+            expr, (
+                ast.Ident, ast.SelfExpr, ast.BoolLiteral, ast.CharLiteral,
+                ast.IntegerLiteral, ast.FloatLiteral, ast.StringLiteral
+            )
+        )
+
+    def gen_fmt_text(self, text, is_raw):
+        return self.gen_string_literal(
+            utils.smart_quote(text, is_raw),
+            self.string_literal_size(text, is_raw)
+        )
+
+    def stringable_to_string(self, value, trait_typ):
+        # `value.to_string()`, through the virtual table of `Stringable`
+        if not isinstance(value.typ, ir.Pointer):
+            value = ir.Inst(ir.InstKind.LoadPtr, [value])
+        tmp = ir.Ident(ir.STRING_T.ptr(True), self.cur_func.local_name())
+        self.cur_func.inline_alloca(
+            tmp.typ, tmp.name,
+            ir.Inst(
+                ir.InstKind.Call, [
+                    self.vtable_method(
+                        trait_typ.symbol(), value, "to_string"
+                    ),
+                    ir.Selector(ir.RAWPTR_T, value, ir.Name("obj"))
+                ]
+            )
+        )
+        return tmp
+
+    def vtable_method(self, trait_sym, self_expr, name, by_index = False):
+        # the method `name` of the trait value `self_expr`, read from the
+        # virtual table of `trait_sym`; `by_index` is used when `self_expr`
+        # is a value of another trait, which stores the index of its type
+        # instead of the id
+        if by_index:
+            id_value = ir.Inst(
+                ir.InstKind.Call, [
+                    ir.Name(
+                        f"{cg_utils.mangle_symbol(trait_sym)}17__index_of_vtbl__"
+                    ),
+                    ir.Selector(ir.UINT_T, self_expr, ir.Name("_idx_"))
+                ]
+            )
+        else:
+            id_value = ir.Selector(ir.UINT_T, self_expr, ir.Name("_id_"))
+        return ir.Selector(
+            ir.RAWPTR_T,
+            ir.Inst(
+                ir.InstKind.LoadPtr, [
+                    ir.Inst(
+                        ir.InstKind.Add, [
+                            ir.Name(
+                                cg_utils.mangle_symbol(trait_sym) + "4VTBL"
+                            ), id_value
+                        ]
+                    )
+                ]
+            ), ir.Name(name)
+        )
+
+    def string_literal_size(self, lit, is_raw):
+        # the escape sequences of `lit` are one byte long, except `\uXXXX`,
+        # which is the UTF-8 encoding of the code point
+        size = utils.bytestr(lit).len
+        if is_raw:
+            return size
+        i = 0
+        while i < len(lit):
+            if lit[i] != "\\":
+                i += 1
+                continue
+            if lit[i + 1:i + 2] == "u":
+                try:
+                    code = chr(int(lit[i + 2:i + 6], 16))
+                    size -= 6 - len(code.encode("utf-8"))
+                    i += 6
+                    continue
+                except ValueError:
+                    pass
+            size -= 1
+            i += 2
+        return size
+
     def default_value(self, typ, custom_tmp = None):
         if isinstance(typ, (type.Ptr, type.Func, type.Boxedptr)):
             return ir.NoneLit(ir.RAWPTR_T)
@@ -2712,45 +3203,63 @@ class Codegen:
         )
 
     def empty_slice(self, typ_sym):
-        elem_typ = typ_sym.info.elem_typ
-        _, _ = self.comp.type_size(elem_typ)
-        return ir.Inst(
-            ir.InstKind.Call, [
-                ir.Name("_R4core5Slice3newF"),
-                ir.Ident(ir.RAWPTR_T, "NULL"),
-                ir.IntLit(ir.UINT_T, "0")
-            ]
-        )
+        # slices are passed by value, so all the empty slices are copies of
+        # a static one, like `Slice.new(null, 0)`
+        tmp = ir.Ident(ir.SLICE_T, "_R4core11empty_slice")
+        if not self.generated_empty_slice:
+            self.out_rir.globals.append(
+                ir.GlobalVar(
+                    False, False, tmp.typ, tmp.name,
+                    ir.StructLit(
+                        ir.SLICE_T, [
+                            ("ptr", ir.NoneLit(ir.RAWPTR_T)),
+                            ("elem_size", ir.IntLit(ir.UINT_T, "0")),
+                            ("len", ir.IntLit(ir.UINT_T, "0"))
+                        ]
+                    )
+                )
+            )
+            self.generated_empty_slice = True
+        return tmp
 
     def gen_string_literal(self, lit, size = None):
         size = size or utils.bytestr(lit).len
         if size == 0:
             return ir.Ident(ir.STRING_T.ptr(True), "_R4core12empty_string")
-        lit_hash = hash(lit)
-        if lit_hash in self.generated_string_literals:
-            return ir.Ident(
-                ir.STRING_T.ptr(True), self.generated_string_literals[lit_hash]
-            )
-        tmp = self.boxed_instance(
-            "_R4core6string",
-            custom_name = f"STRLIT{len(self.generated_string_literals)}"
-        )
+        if name := self.generated_string_literals.get(lit):
+            return ir.Ident(ir.STRING_T.ptr(True), name)
+        # named after their content, so the same literal gets the same
+        # name in every program
+        name = f"STRLIT{hashlib.sha1(lit.encode()).hexdigest()[:16]}"
+        while name in self.string_literal_names:
+            name += "_"
+        self.string_literal_names.add(name)
+        # the string object is a constant, initialized statically
+        obj = ir.Ident(ir.STRING_T, f"{name}_obj")
         self.out_rir.globals.append(
-            ir.GlobalVar(False, False, ir.STRING_T.ptr(True), tmp.name)
-        )
-        self.init_string_lits_fn.store(
-            ir.Selector(ir.UINT8_T.ptr(), tmp, ir.Name("ptr")),
-            ir.StringLit(lit, size)
-        )
-        self.init_string_lits_fn.store(
-            ir.Selector(ir.UINT_T, tmp, ir.Name("len")),
-            ir.IntLit(ir.UINT_T, str(size))
+            ir.GlobalVar(
+                False, False, ir.STRING_T, obj.name,
+                ir.StructLit(
+                    ir.STRING_T, [
+                        ("ptr", ir.StringLit(lit, size)),
+                        ("len", ir.IntLit(ir.UINT_T, str(size))),
+                        ("is_ref", ir.IntLit(ir.BOOL_T, "1"))
+                    ]
+                ), is_const = True
+            )
         )
-        self.init_string_lits_fn.store(
-            ir.Selector(ir.BOOL_T, tmp, ir.Name("is_ref")),
-            ir.IntLit(ir.BOOL_T, "1")
+        tmp = ir.Ident(ir.STRING_T.ptr(True), name)
+        self.out_rir.globals.append(
+            ir.GlobalVar(
+                False, False, tmp.typ, name,
+                # not `const`, the generated code can take its address
+                ir.Inst(
+                    ir.InstKind.Cast,
+                    [ir.Inst(ir.InstKind.GetPtr, [obj]), tmp.typ]
+                )
+            )
         )
-        self.generated_string_literals[lit_hash] = tmp.name
+        self.generated_string_literals[lit] = name
         return tmp
 
     def stacked_instance(self, typ, init_value = None):
@@ -2761,20 +3270,16 @@ class Codegen:
             self.cur_func.alloca(tmp)
         return tmp
 
-    def boxed_instance(self, name, custom_name = None):
-        tmp = ir.Ident(
-            ir.Type(name).ptr(True), custom_name or self.cur_func.local_name()
-        )
-        to_fn = self.init_string_lits_fn if custom_name else self.cur_func
-        inst = ir.Inst(
-            ir.InstKind.Call,
-            [ir.Name("_R4core3mem9raw_allocF"),
-             ir.Name(f"sizeof({name})")]
+    def boxed_instance(self, name):
+        tmp = ir.Ident(ir.Type(name).ptr(True), self.cur_func.local_name())
+        self.cur_func.alloca(
+            tmp,
+            ir.Inst(
+                ir.InstKind.Call,
+                [ir.Name("_R4core3mem9raw_allocF"),
+                 ir.Name(f"sizeof({name})")]
+            )
         )
-        if custom_name:
-            to_fn.store(tmp, inst)
-        else:
-            to_fn.alloca(tmp, inst)
         return tmp
 
     def trait_value(self, value, value_typ, trait_typ):
@@ -2784,6 +3289,8 @@ class Codegen:
         trait_sym = trait_typ.symbol()
         size, _ = self.comp.type_size(value_typ)
         tmp = self.boxed_instance(cg_utils.mangle_symbol(trait_sym))
+        box = self.cur_func.instrs[-1]
+        value_store = None
         is_ptr = isinstance(value.typ, ir.Pointer)
         for f in trait_sym.fields:
             f_typ = self.ir_type(f.typ)
@@ -2821,6 +3328,9 @@ class Codegen:
             self.cur_func.store(
                 ir.Selector(ir.RAWPTR_T, tmp, ir.Name("obj")), value
             )
+            if not is_ptr and isinstance(value.args[1].args[0].typ, ir.Type):
+                value_store = self.cur_func.instrs[-1]
+        self.cur_func.trait_boxes.append((box, value_store))
         self.cur_func.store(ir.Selector(ir.UINT_T, tmp, ir.Name("_id_")), index)
         self.cur_func.store(
             ir.Selector(ir.UINT_T, tmp, ir.Name("_idx_")),
@@ -2839,7 +3349,7 @@ class Codegen:
                 tmp = self.boxed_instance(mangled_name)
             else:
                 tmp = self.stacked_instance(ir.Type(mangled_name))
-        uint_t = ir.UINT_T
+        uint_t = self.enum_tag_ir_type(enum_sym)
         variant_info = enum_sym.info.get_variant(variant_name)
         self.cur_func.store(
             ir.Selector(uint_t, tmp, ir.Name("_idx_")),
@@ -2874,9 +3384,10 @@ class Codegen:
             else:
                 tmp = self.stacked_instance(ir.Type(mangled_name))
         variant_info = enum_sym.info.get_variant(variant_name)
+        tag_t = self.enum_tag_ir_type(enum_sym)
         self.cur_func.store(
-            ir.Selector(ir.UINT_T, tmp, ir.Name("_idx_")),
-            ir.IntLit(ir.UINT_T, variant_info.value)
+            ir.Selector(tag_t, tmp, ir.Name("_idx_")),
+            ir.IntLit(tag_t, variant_info.value)
         )
         obj_f = ir.Selector(
             ir.Type(f"{cg_utils.mangle_symbol(enum_sym)}6_Union"), tmp,
@@ -2954,13 +3465,11 @@ class Codegen:
         else:
             cond = ir.Inst(
                 ir.InstKind.BooleanNot,
-                [ir.Selector(ir.BOOL_T, gexpr, ir.Name("is_none"))]
+                [self.option_is_none(expr.expr.typ, gexpr)]
             )
             self.cur_func.inline_alloca(
                 self.ir_type(expr.typ), var_name,
-                ir.Selector(
-                    self.ir_type(expr.expr.typ.typ), gexpr, ir.Name("value")
-                )
+                self.option_unwrap(expr.expr.typ, gexpr)
             )
         if expr.has_cond and gen_cond:
             self.cur_func.add_cond_br(
@@ -2990,7 +3499,9 @@ class Codegen:
                 self.generated_opt_res_types.append(name)
             return ir.Type(name)
         elif isinstance(typ, type.Option):
-            if typ.is_pointer():
+            if typ.is_pointer() or self.comp.layout.option_niche(
+                typ.typ
+            ) != None:
                 return self.ir_type(typ.typ)
             name = f"_R6Option{cg_utils.mangle_type(typ.typ)}"
             if name not in self.generated_opt_res_types:
@@ -3090,7 +3601,7 @@ class Codegen:
                     union_name = mangled_name + "6_Union"
                     self.out_rir.types.append(ir.Union(union_name, fields))
                     struct_fields = [
-                        ir.Field("_idx_", ir.UINT_T),
+                        ir.Field("_idx_", self.enum_tag_ir_type(ts)),
                         ir.Field("obj", ir.Type(union_name))
                     ]
                     self.out_rir.types.append(
@@ -3161,31 +3672,15 @@ class Codegen:
                         cg_utils.mangle_symbol(ts) + "17__index_of_vtbl__",
                         [ir.Ident(ir.UINT_T, "self")], False, ir.UINT_T, False
                     )
-                    for child_name, child_idx_, child_idx_x in index_of_vtbl:
-                        l1 = index_of_vtbl_fn.local_name()
-                        l2 = index_of_vtbl_fn.local_name()
-                        index_of_vtbl_fn.add_comment(f"for: '{child_name}'")
-                        index_of_vtbl_fn.add_cond_br(
-                            ir.Inst(
-                                ir.InstKind.Cmp, [
-                                    "==",
-                                    ir.Ident(ir.UINT_T, "self"),
-                                    ir.IntLit(ir.UINT_T, str(child_idx_))
-                                ]
-                            ), l1, l2
-                        )
-                        index_of_vtbl_fn.add_label(l1)
-                        index_of_vtbl_fn.add_ret(
-                            ir.IntLit(ir.UINT_T, str(child_idx_x))
-                        )
-                        index_of_vtbl_fn.add_label(l2)
-                    index_of_vtbl_fn.add_ret(ir.IntLit(ir.UINT_T, "0"))
+                    self.gen_index_of_vtbl(
+                        index_of_vtbl_fn, f"{ts_name}4IDXS", index_of_vtbl
+                    )
                     self.out_rir.decls.append(index_of_vtbl_fn)
             elif ts.kind in (
                 TypeKind.Struct, TypeKind.String, TypeKind.DynArray
             ):
                 fields = []
-                for f in ts.full_fields():
+                for f in self.comp.layout.type_symbol_layout(ts).fields:
                     fields.append(ir.Field(f.name, self.ir_type(f.typ)))
                 self.out_rir.types.append(
                     ir.Struct(
@@ -3193,6 +3688,138 @@ class Codegen:
                     )
                 )
 
+    def index_in_bounds(self, expr):
+        # Reports whether the index of `expr` is always lower than the length
+        # of the indexed value, so the bounds check can be removed:
+        # * constant indexes into fixed arrays.
+        # * the (immutable) index of a `for` loop, into the fixed array
+        #   iterated or any larger one, or into the slice or dynamic array
+        #   iterated, if it is invariant (see `iterable_is_invariant`).
+        if not self.comp.prefs.remove_bounds_checks:
+            return False
+        left_sym = expr.left.typ.symbol()
+        if left_sym.kind == TypeKind.Array:
+            size = int(left_sym.info.size.lit, 0)
+            index = self.comp.const_eval.eval_expr(expr.index)
+            if isinstance(index, int) and not isinstance(index, bool):
+                return 0 <= index < size
+        if not (isinstance(expr.index, ast.Ident) and expr.index.is_obj):
+            return False
+        for loop, is_invariant in self.counted_loops:
+            if loop.index == None or loop.index.is_mut or loop.scope.lookup(
+                loop.index.name
+            ) is not expr.index.obj:
+                continue
+            iterable_sym = loop.iterable.typ.symbol()
+            if left_sym.kind == TypeKind.Array:
+                return iterable_sym.kind == TypeKind.Array and int(
+                    iterable_sym.info.size.lit, 0
+                ) <= int(left_sym.info.size.lit, 0)
+            elif left_sym.kind in (TypeKind.DynArray, TypeKind.Slice):
+                return is_invariant and isinstance(
+                    expr.left, ast.Ident
+                ) and expr.left.is_obj and loop.iterable.obj is expr.left.obj
+            return False
+        return False
+
+    def iterable_is_invariant(self, loop):
+        # Reports whether the `ptr` and `len` of the slice or dynamic array
+        # iterated by `loop` cannot change in its body: it must be an
+        # immutable object, and since the length of a dynamic array can also
+        # change through other references, the body of a loop over a dynamic
+        # array cannot have calls.
+        if not (
+            isinstance(loop.iterable, ast.Ident) and loop.iterable.is_obj
+            and not loop.iterable.obj.is_mut
+        ):
+            return False
+        iterable_sym = loop.iterable.typ.symbol()
+        if iterable_sym.kind == TypeKind.Slice:
+            return True
+        return iterable_sym.kind == TypeKind.DynArray and not self.has_calls(
+            loop.stmt
+        )
+
+    def has_calls(self, node, visited = None):
+        # Reports whether the statement or expression `node` has a call.
+        if isinstance(node, ast.CallExpr):
+            return True
+        if visited == None:
+            visited = set()
+        if id(node) in visited:
+            return False
+        visited.add(id(node))
+        for name, value in vars(node).items():
+            if name in ("scope", "sym", "obj", "typ"):
+                continue
+            for v in value if isinstance(value, list) else [value]:
+                if v.__class__.__module__ == ast.__name__ and hasattr(
+                    v, "__dict__"
+                ) and self.has_calls(v, visited):
+                    return True
+        return False
+
+    def gen_index_of_vtbl(self, decl, table_name, index_of_vtbl):
+        # `_idx_` (the symbol ID of the value of a trait object) -> the
+        # index of its type in the virtual table, looked up in a static
+        # table that goes from the lowest ID of the implementors to the
+        # highest one.
+        first_id = min(child_id for _, child_id, _ in index_of_vtbl)
+        indexes = [0] * (
+            max(child_id for _, child_id, _ in index_of_vtbl) - first_id + 1
+        )
+        # the first implementation wins, like in `TraitInfo.indexof`
+        for _, child_id, child_idx in reversed(index_of_vtbl):
+            indexes[child_id - first_id] = child_idx
+        if len(index_of_vtbl) <= 0xFF:
+            elem_typ = ir.UINT8_T
+        elif len(index_of_vtbl) <= 0xFFFF:
+            elem_typ = ir.UINT16_T
+        else:
+            elem_typ = ir.UINT32_T
+        table = ir.Ident(ir.Array(elem_typ, len(indexes)), table_name)
+        self.out_rir.globals.append(
+            ir.GlobalVar(
+                False, False, table.typ, table.name,
+                ir.ArrayLit(
+                    elem_typ, [ir.IntLit(elem_typ, str(i)) for i in indexes]
+                ), True
+            )
+        )
+        offset = ir.Ident(ir.UINT_T, decl.local_name())
+        decl.alloca(
+            offset,
+            ir.Inst(
+                ir.InstKind.Sub, [
+                    ir.Ident(ir.UINT_T, "self"),
+                    ir.IntLit(ir.UINT_T, str(first_id))
+                ], ir.UINT_T
+            )
+        )
+        in_table_label = decl.local_name()
+        not_found_label = decl.local_name()
+        decl.add_cond_br(
+            ir.Inst(
+                ir.InstKind.Cmp, [
+                    "<", offset,
+                    ir.IntLit(ir.UINT_T, str(len(indexes)))
+                ]
+            ), in_table_label, not_found_label
+        )
+        decl.add_label(in_table_label)
+        decl.add_ret(
+            ir.Inst(
+                ir.InstKind.LoadPtr, [
+                    ir.Inst(
+                        ir.InstKind.GetElementPtr, [table, offset],
+                        elem_typ.ptr()
+                    )
+                ], elem_typ
+            )
+        )
+        decl.add_label(not_found_label)
+        decl.add_ret(ir.IntLit(ir.UINT_T, "0"))
+
     def get_type_symbols(self, root):
         ts = []
         for s in root.syms:
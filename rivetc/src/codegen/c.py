@@ -2,12 +2,14 @@
 # Use of this source code is governed by an MIT license that can
 # be found in the LICENSE file.
 
-import os
+import os, shutil, hashlib
+from os import path
+from concurrent.futures import ThreadPoolExecutor
 
-from .. import prefs, utils
+from .. import cache, prefs, utils
 
 from .ir import InstKind
-from . import ir, c_headers
+from . import ir, c_headers, cg_utils, prune
 
 MIN_INT64 = -9223372036854775808
 
@@ -25,14 +27,53 @@ C_RESERVED = [
 def c_escape(kw):
     return f"_{kw}_" if kw in C_RESERVED else kw
 
+class SourceWriter(utils.Builder):
+    # Writes a C file as it is generated, hashing its text for
+    # `cache.ObjCache`.
+    def __init__(self, file):
+        self.buf = open(file, "w+", encoding = "UTF-8")
+        self.len_ = 0
+        self.hash = hashlib.sha1()
+
+    def write(self, txt):
+        self.len_ += self.buf.write(txt)
+        self.hash.update(txt.encode())
+
+    def close(self):
+        self.buf.close()
+        return self.hash.hexdigest()
+
 class CGen:
+    """Generates one C translation unit per module.
+
+    Every unit starts with the prelude (`c_headers.HEADER`, precompiled
+    once inside `RIVET_DIR/lib`), followed by the declarations used by its
+    functions; the root unit also defines the globals and virtual tables.
+    Every function and global has external linkage (`RIVET_HIDDEN`, hidden
+    visibility), so the units can refer to each other.
+
+    The units are compiled in parallel to object files cached inside
+    `RIVET_DIR/obj` (see `cache.ObjCache`) and then linked. The units of
+    the runtime (`core` and `c`) are packed into a static archive inside
+    `RIVET_DIR/lib`, which is linked as is by the programs that generate
+    the same runtime code.
+    """
     def __init__(self, comp):
         self.comp = comp
-        self.typedefs = utils.Builder()
-        self.types = utils.Builder()
         self.protos = utils.Builder()
-        self.globals = utils.Builder()
-        self.out = utils.Builder()
+        # the functions of the units and the definitions of the globals are
+        # written to temporary files and copied to the C files at the end,
+        # so the generated code is never fully in memory
+        self.global_defs = utils.FileBuilder()
+        # the declarations, in the order that they are generated
+        self.c_types = [] # (name, typedef, definition)
+        self.c_protos = {} # function name -> prototype
+        self.c_globals = {} # global or virtual table name -> declaration
+        self.types_by_name = {}
+        self.symbols = {} # function, global or virtual table name -> decl
+        self.units = {} # module name -> (functions, C code)
+        self.c_type_names = {} # (IR type, wrapped name) -> C type
+        _, self.out = self.unit("")
 
     def gen(self, out_rir):
         self.comp.vlog("cgen: generating types...")
@@ -44,51 +85,228 @@ class CGen:
         self.comp.vlog("cgen: generating decls...")
         self.gen_decls(out_rir.decls)
 
-        self.comp.vlog("cgen: generating C file...")
-        c_file = f"module.{self.comp.prefs.mod_name}.c"
-        with open(c_file, "w+") as out:
-            out.write(c_headers.HEADER)
-            if self.comp.prefs.build_mode != prefs.BuildMode.Release:
-                out.write(c_headers.RIVET_BREAKPOINT)
-            out.write(str(self.typedefs).strip() + "\n\n")
-            out.write(str(self.types).strip() + "\n\n")
-            out.write(str(self.protos).strip() + "\n\n")
-            out.write(str(self.globals).strip() + "\n\n")
-            out.write(str(self.out).strip())
-
-        self.comp.vlog("cgen: generating C compiler arguments...")
+        self.comp.vlog("cgen: generating C files...")
+        mod_name = self.comp.prefs.mod_name
+        args = self.compiler_args()
+        obj_cache = cache.ObjCache(self.comp, args)
+        prelude = self.gen_prelude(args, obj_cache)
+        c_files = []
+        for unit_name, (decls, unit) in self.units.items():
+            is_root = unit_name == mod_name
+            if is_root:
+                c_file = f"module.{mod_name}.c"
+            else:
+                c_file = f"module.{mod_name}.{unit_name}.c"
+            source = SourceWriter(c_file)
+            source.writeln(f'#include "{prelude}"\n')
+            self.gen_unit_header(source, decls, is_root)
+            if is_root:
+                self.global_defs.copy_to(source)
+                source.writeln()
+            unit.copy_to(source)
+            unit.close()
+            c_files.append((unit_name, c_file, source.close()))
+        self.global_defs.close()
+
+        self.comp.vlog("cgen: compiling C files...")
+        obj_files = self.compile_units(args, obj_cache, c_files)
+        self.comp.vlog("cgen: linking object files...")
+        self.link(obj_files)
+        if not self.comp.prefs.keep_c:
+            for _, c_file, _ in c_files:
+                os.remove(c_file)
+
+    def compiler_args(self):
+        p = self.comp.prefs
         args = [
-            self.comp.prefs.target_backend_compiler, "-o",
-            self.comp.prefs.mod_output, "-Werror", "-fno-builtin", "-fwrapv",
-            "-m64" if self.comp.prefs.target_bits == prefs.Bits.X64 else "-m32",
+            p.target_backend_compiler, "-c", "-Werror", "-fno-builtin",
+            "-fwrapv", "-m64" if p.target_bits == prefs.Bits.X64 else "-m32",
+            f"-I{cache.LIB_DIR}"
         ]
-        if self.comp.prefs.build_mode == prefs.BuildMode.Release:
+        if p.build_mode == prefs.BuildMode.Release:
             args.append("-flto")
             args.append("-O3")
         else:
             args.append("-g")
-        if self.comp.prefs.target_os == prefs.OS.Windows:
+        if p.target_os == prefs.OS.Windows:
             args.append(f"-municode")
-        for l in self.comp.prefs.library_path:
-            args.append(f"-L{l}")
-        for f in self.comp.prefs.flags:
+        for f in p.flags:
             args.append(f"-D{f}")
-        args.append(c_file)
-        for obj in self.comp.prefs.objects_to_link:
+        return args
+
+    def gen_prelude(self, args, obj_cache):
+        # The prelude is the same for every unit, so it is saved (and
+        # precompiled, if the C compiler supports it) once per compiler
+        # and arguments; the C compiler ignores an unusable `.gch` file.
+        prelude = c_headers.HEADER
+        if self.comp.prefs.build_mode != prefs.BuildMode.Release:
+            prelude += c_headers.RIVET_BREAKPOINT
+        key = hashlib.sha1(
+            f"{obj_cache.compiler_id}|{' '.join(args)}\0{prelude}".encode()
+        ).hexdigest()[:16]
+        name = f"prelude_{key}.h"
+        h_file = path.join(cache.LIB_DIR, name)
+        if not path.isfile(h_file):
+            tmp_file = f"{h_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w+", encoding = "UTF-8") as out:
+                out.write(prelude)
+            os.replace(tmp_file, h_file)
+        gch_file = f"{h_file}.gch"
+        if not path.isfile(gch_file):
+            self.comp.vlog(f"cgen: precompiling `{h_file}`...")
+            tmp_file = f"{gch_file}.{os.getpid()}.tmp"
+            res = utils.execute(
+                *args, "-x", "c-header", "-o", tmp_file, h_file
+            )
+            if res.exit_code == 0:
+                os.replace(tmp_file, gch_file)
+            else:
+                self.comp.vlog(f"cgen: cannot precompile the prelude:\n{res.err}")
+                if path.isfile(tmp_file):
+                    os.remove(tmp_file)
+        obj_cache.use(h_file)
+        obj_cache.use(gch_file)
+        return name
+
+    def gen_unit_header(self, sb, decls, is_root):
+        # Only the declarations used by `decls` are written, so the unit
+        # (and its cached object) does not change when unrelated code does.
+        if is_root:
+            names, types = None, None
+        else:
+            refs = prune.References()
+            for decl in decls:
+                refs.names.add(decl.name)
+                refs.add_decl(decl)
+            for name in list(refs.names):
+                if decl := self.symbols.get(name):
+                    refs.add_signature(decl)
+            names = refs.names
+            types = prune.used_types(self.types_by_name, refs.types)
+        for name, typedef, _ in self.c_types:
+            if types == None or name in types:
+                sb.write(typedef)
+        sb.writeln()
+        for name, _, definition in self.c_types:
+            if types == None or name in types:
+                sb.write(definition)
+        sb.writeln()
+        for name, proto in self.c_protos.items():
+            if names == None or name in names:
+                sb.write(proto)
+        sb.writeln()
+        for name, decl in self.c_globals.items():
+            if names == None or name in names:
+                sb.write(decl)
+        sb.writeln()
+
+    def compile_units(self, args, obj_cache, c_files):
+        units = []
+        obj_files = []
+        runtime_objs = []
+        for unit_name, c_file, source_hash in c_files:
+            obj_file = obj_cache.object_file(unit_name, source_hash)
+            if cg_utils.is_runtime_module(unit_name):
+                runtime_objs.append(obj_file)
+            else:
+                obj_files.append(obj_file)
+            units.append((c_file, obj_file))
+        archive = self.runtime_archive(runtime_objs)
+        if archive != None and obj_cache.use(archive):
+            self.comp.vlog(f"cgen: using the prebuilt runtime `{archive}`")
+            units = [unit for unit in units if unit[1] not in runtime_objs]
+            runtime_objs = []
+        to_compile = []
+        for c_file, obj_file in units:
+            if obj_cache.lookup(obj_file):
+                self.comp.vlog(f"cgen: `{c_file}` is cached as `{obj_file}`")
+                continue
+            # the object is renamed once it is complete, so the cache never
+            # holds partial objects
+            tmp_file = f"{obj_file}.{os.getpid()}.tmp"
+            to_compile.append((
+                c_file, obj_file, tmp_file, args + ["-o", tmp_file, c_file]
+            ))
+            self.comp.vlog(f"C compiler arguments: {' '.join(to_compile[-1][3])}")
+        if len(to_compile) > 0:
+            jobs = min(len(to_compile), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers = jobs) as pool:
+                results = list(
+                    pool.map(lambda unit: utils.execute(*unit[3]), to_compile)
+                )
+            for (c_file, obj_file, tmp_file, _), res in zip(to_compile, results):
+                if res.exit_code != 0:
+                    if path.isfile(tmp_file):
+                        os.remove(tmp_file)
+                    utils.error(
+                        f"error while compiling the output C file `{c_file}`:\n{res.err}"
+                    )
+                os.replace(tmp_file, obj_file)
+        if archive != None:
+            if len(runtime_objs) > 0:
+                self.pack_runtime_archive(archive, runtime_objs)
+            obj_files.append(archive)
+        else:
+            obj_files += runtime_objs
+        obj_cache.trim()
+        if self.comp.prefs.show_cache_stats:
+            for line in obj_cache.summary():
+                utils.eprint(f"rivetc: cache: {line}")
+        return obj_files
+
+    def runtime_archive(self, runtime_objs):
+        # The runtime objects are named after their content, so they name
+        # the archive too. Archives of LTO objects need the linker plugin,
+        # so release builds link the objects directly.
+        if len(runtime_objs) == 0 or shutil.which("ar") == None:
+            return None
+        elif self.comp.prefs.build_mode == prefs.BuildMode.Release:
+            return None
+        key = hashlib.sha1(
+            "|".join(path.basename(obj) for obj in runtime_objs).encode()
+        ).hexdigest()[:16]
+        return path.join(
+            cache.LIB_DIR, f"libcore_{key}_{self.comp.prefs.get_obj_postfix()}.a"
+        )
+
+    def pack_runtime_archive(self, archive, runtime_objs):
+        self.comp.vlog(f"cgen: packing the runtime into `{archive}`...")
+        tmp_file = f"{archive}.{os.getpid()}.tmp"
+        res = utils.execute("ar", "rcs", tmp_file, *runtime_objs)
+        if res.exit_code != 0:
+            utils.error(f"error while packing the runtime `{archive}`:\n{res.err}")
+        os.replace(tmp_file, archive)
+
+    def link(self, obj_files):
+        p = self.comp.prefs
+        args = [
+            p.target_backend_compiler, "-o", p.mod_output,
+            "-m64" if p.target_bits == prefs.Bits.X64 else "-m32",
+        ]
+        if p.build_mode == prefs.BuildMode.Release:
+            args.append("-flto")
+            args.append("-O3")
+        if p.target_os == prefs.OS.Windows:
+            args.append(f"-municode")
+        for l in p.library_path:
+            args.append(f"-L{l}")
+        args += obj_files
+        for obj in p.objects_to_link:
             args.append(obj)
-        for l in self.comp.prefs.libraries_to_link:
+        for l in p.libraries_to_link:
             args.append(f"-l{l}")
-        self.comp.vlog(f"C compiler arguments: {' '.join(args)}")
-
-        self.comp.vlog("cgen: compiling C file...")
+        self.comp.vlog(f"linker arguments: {' '.join(args)}")
         res = utils.execute(*args)
-        if res.exit_code == 0:
-            if not self.comp.prefs.keep_c:
-                os.remove(c_file)
-        else:
-            utils.error(
-                f"error while compiling the output C file `{c_file}`:\n{res.err}"
-            )
+        if res.exit_code != 0:
+            utils.error(f"error while linking `{p.mod_output}`:\n{res.err}")
+
+    def unit(self, mod_name):
+        # functions generated by the compiler go to the root module
+        if mod_name == "":
+            mod_name = self.comp.prefs.mod_name
+        if mod_name not in self.units:
+            self.units[mod_name] = ([], utils.FileBuilder())
+        return self.units[mod_name]
 
     def write(self, txt):
         self.out.write(txt)
@@ -98,78 +316,123 @@ class CGen:
 
     def gen_types(self, types):
         for s in types:
+            self.types_by_name[s.name] = s
+            typedef = utils.Builder()
+            definition = utils.Builder()
             if isinstance(s, ir.Struct):
-                self.typedefs.writeln(f"typedef struct {s.name} {s.name};")
+                typedef.writeln(f"typedef struct {s.name} {s.name};")
                 if not s.is_opaque:
-                    self.types.writeln(f"struct {s.name} {{")
+                    definition.writeln(f"struct {s.name} {{")
                     for i, f in enumerate(s.fields):
                         f_name = c_escape(f.name)
-                        self.types.write("  ")
-                        self.types.write(self.gen_type(f.typ, f_name))
+                        definition.write("  ")
+                        definition.write(self.gen_type(f.typ, f_name))
                         if not isinstance(f.typ, (ir.Array, ir.Function)):
-                            self.types.write(f" {f_name}")
-                        self.types.writeln(";")
-                    self.types.writeln("};")
-                self.types.writeln()
+                            definition.write(f" {f_name}")
+                        definition.writeln(";")
+                    definition.writeln("};")
+                definition.writeln()
             else:
-                self.typedefs.writeln(f"typedef union {s.name} {s.name};")
-                self.types.writeln(f"union {s.name} {{")
+                typedef.writeln(f"typedef union {s.name} {s.name};")
+                definition.writeln(f"union {s.name} {{")
                 for i, f in enumerate(s.fields):
                     f_name = c_escape(f.name)
-                    self.types.write("  ")
-                    self.types.write(self.gen_type(f.typ, f_name))
+                    definition.write("  ")
+                    definition.write(self.gen_type(f.typ, f_name))
                     if not isinstance(f.typ, (ir.Array, ir.Function)):
-                        self.types.write(f" {f_name}")
-                    self.types.writeln(";")
-                self.types.writeln("};\n")
+                        definition.write(f" {f_name}")
+                    definition.writeln(";")
+                definition.writeln("};\n")
+            self.c_types.append((s.name, str(typedef), str(definition)))
 
     def gen_externs(self, externs):
         for extern_fn in externs:
+            self.symbols[extern_fn.name] = extern_fn
             self.gen_fn_decl(extern_fn)
 
     def gen_globals(self, globals):
+        # the root unit defines the globals, the other units declare the
+        # globals that they use
         for g in globals:
-            if not g.is_public:
-                self.globals.write("RIVET_LOCAL ")
-            if g.is_extern:
-                self.globals.write("extern ")
+            self.symbols[g.name] = g
             if isinstance(g.typ, ir.Array):
-                self.globals.write(self.gen_type(g.typ, g.name))
+                decl = self.gen_type(g.typ, g.name)
+                if g.is_const:
+                    decl = f"const {decl}"
+            elif g.is_const:
+                decl = f"{self.gen_type(g.typ)} const {g.name}"
+            else:
+                decl = f"{self.gen_type(g.typ)} {g.name}"
+            if g.is_extern:
+                self.c_globals[g.name] = f"extern {decl};\n"
+                continue
+            elif g.is_public:
+                self.c_globals[g.name] = f"extern {decl};\n"
             else:
-                self.globals.write(self.gen_type(g.typ))
-                self.globals.write(" ")
-                self.globals.write(g.name)
-            self.globals.writeln(";")
+                self.c_globals[g.name] = f"extern RIVET_HIDDEN {decl};\n"
+                self.global_defs.write("RIVET_HIDDEN ")
+            self.global_defs.write(decl)
+            if g.value:
+                self.global_defs.write(" = ")
+                old_out = self.out
+                self.out = self.global_defs
+                if isinstance(g.value, ir.ArrayLit):
+                    # an initializer list, not a compound literal
+                    self.write("{ ")
+                    for i, elem in enumerate(g.value.elems):
+                        if i > 0:
+                            self.write(", ")
+                        self.gen_expr(elem)
+                    self.write(" }")
+                elif isinstance(g.value, ir.StructLit):
+                    self.write("{ ")
+                    for i, (name, value) in enumerate(g.value.fields):
+                        if i > 0:
+                            self.write(", ")
+                        self.write(f".{c_escape(name)} = ")
+                        self.gen_expr(value)
+                    self.write(" }")
+                else:
+                    self.gen_expr(g.value)
+                self.out = old_out
+            self.global_defs.writeln(";")
 
     def gen_decls(self, decls):
         for decl in decls:
+            self.symbols[decl.name] = decl
             if isinstance(decl, ir.FuncDecl):
+                unit_decls, self.out = self.unit(decl.mod_name)
+                unit_decls.append(decl)
                 self.gen_fn_decl(decl)
+                self.writeln()
             else:
                 self.gen_vtable(decl)
-            self.writeln()
 
     def gen_vtable(self, decl):
-        self.globals.writeln(
-            f"static {decl.structure} {decl.name}[{decl.implement_nr}] = {{"
+        self.c_globals[decl.name] = (
+            f"extern RIVET_HIDDEN {decl.structure} {decl.name}[{decl.implement_nr}];\n"
+        )
+        self.global_defs.writeln(
+            f"RIVET_HIDDEN {decl.structure} {decl.name}[{decl.implement_nr}] = {{"
         )
         for i, ft in enumerate(decl.funcs):
-            self.globals.writeln('  {')
+            self.global_defs.writeln('  {')
             items = ft.items()
             for i2, (f, impl) in enumerate(items):
-                self.globals.write(f'    .{f} = (void*){impl}')
+                self.global_defs.write(f'    .{f} = (void*){impl}')
                 if i2 < len(items) - 1:
-                    self.globals.writeln(", ")
+                    self.global_defs.writeln(", ")
                 else:
-                    self.globals.writeln()
-            self.globals.write("  }")
+                    self.global_defs.writeln()
+            self.global_defs.write("  }")
             if i < len(decl.funcs) - 1:
-                self.globals.writeln(",")
+                self.global_defs.writeln(",")
             else:
-                self.globals.writeln()
-        self.globals.writeln("};")
+                self.global_defs.writeln()
+        self.global_defs.writeln("};")
 
     def gen_fn_decl(self, decl):
+        self.protos = utils.Builder()
         if decl.is_never:
             if not decl.is_extern:
                 self.write("RIVET_NEVER ")
@@ -179,8 +442,8 @@ class CGen:
                 self.write("RIVET_EXPORT ")
                 self.protos.write("RIVET_EXPORT ")
             else:
-                self.write("RIVET_LOCAL ")
-                self.protos.write("RIVET_LOCAL ")
+                self.write("RIVET_HIDDEN ")
+                self.protos.write("RIVET_HIDDEN ")
         if decl.attrs.has("inline") and not decl.is_extern:
             self.write("inline ")
         if isinstance(decl.ret_typ, ir.Function):
@@ -223,6 +486,7 @@ class CGen:
                 if i < len(decl.ret_typ.args) - 1:
                     self.protos.write(", ")
         self.protos.writeln(");")
+        self.c_protos[decl.name] = str(self.protos)
         if not decl.is_extern:
             if isinstance(decl.ret_typ, ir.Function):
                 self.write(") (")
@@ -359,6 +623,16 @@ class CGen:
                 self.write(f") goto {inst.args[1].name}")
                 if len(inst.args) == 3:
                     self.write(f"; else goto {inst.args[2].name}")
+        elif inst.kind == InstKind.Switch:
+            # args: value, default label, (case value, label)...
+            self.write("switch (")
+            self.gen_expr(inst.args[0])
+            self.write(") { ")
+            for i in range(2, len(inst.args), 2):
+                self.write("case ")
+                self.gen_expr(inst.args[i])
+                self.write(f": goto {inst.args[i + 1].name}; ")
+            self.write(f"default: goto {inst.args[1].name}; }}")
         elif inst.kind == InstKind.Call:
             self.gen_expr(inst.args[0])
             self.write("(")
@@ -420,6 +694,16 @@ class CGen:
                 if i < len(expr.elems) - 1:
                     self.write(", ")
             self.write(" }")
+        elif isinstance(expr, ir.StructLit):
+            self.write("(")
+            self.write_type(expr.typ)
+            self.write("){ ")
+            for i, (name, value) in enumerate(expr.fields):
+                self.write(f".{c_escape(name)} = ")
+                self.gen_expr(value)
+                if i < len(expr.fields) - 1:
+                    self.write(", ")
+            self.write(" }")
         elif isinstance(expr, ir.Ident):
             self.write(c_escape(expr.name))
         elif isinstance(expr, ir.Name):
@@ -438,6 +722,15 @@ class CGen:
         self.write(self.gen_type(typ, wrap))
 
     def gen_type(self, typ, wrap = ""):
+        # IR types are interned, so the C form of each one is built once
+        key = (typ, wrap)
+        if c_type := self.c_type_names.get(key):
+            return c_type
+        c_type = self.gen_c_type(typ, wrap)
+        self.c_type_names[key] = c_type
+        return c_type
+
+    def gen_c_type(self, typ, wrap):
         if isinstance(typ, ir.Pointer):
             return f"{self.gen_type(typ.typ, wrap)}*"
         elif isinstance(typ, ir.Array):
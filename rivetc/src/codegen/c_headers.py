@@ -12,6 +12,7 @@ HEADER = f"// Auto-generated by {full_version()}" + """. DO NOT MODIFY!
 #if defined(_WIN32) || defined(__CYGWIN__)
 	#define RIVET_EXPORT extern __declspec(dllexport)
 	#define RIVET_LOCAL static
+	#define RIVET_HIDDEN
 #else
 	// 4 < GCC < 5 is used by some older Ubuntu LTS and CentOS versions, and does
 	// not support __has_attribute(visibility):
@@ -31,9 +32,12 @@ HEADER = f"// Auto-generated by {full_version()}" + """. DO NOT MODIFY!
 		#else
 			#define RIVET_LOCAL __attribute__ ((visibility ("hidden")))
 		#endif
+		// like `RIVET_LOCAL`, but it can be used from other translation units
+		#define RIVET_HIDDEN __attribute__ ((visibility ("hidden")))
 	#else
 		#define RIVET_EXPORT extern
 		#define RIVET_LOCAL static
+		#define RIVET_HIDDEN
 	#endif
 #endif
 
@@ -2,12 +2,21 @@
 # Use of this source code is governed by an MIT license that can
 # be found in the LICENSE file.
 
-import os
+import os, re
 
 from ..sym import TypeKind
 from .. import ast, sym, type, utils
 from ..token import OVERLOADABLE_OPERATORS_STR
 
+# the modules whose C code is prebuilt into a static archive
+RUNTIME_MODULES = ("c", "core")
+
+def is_runtime_module(mod_name):
+    for name in RUNTIME_MODULES:
+        if mod_name == name or mod_name.startswith(f"{name}."):
+            return True
+    return False
+
 def decode_escape(ch):
     if ch.startswith("\\"):
         code = ch[1:]
@@ -26,6 +35,19 @@ def decode_escape(ch):
             return "\v"
     return ch
 
+def is_plain_string_literal(expr):
+    return isinstance(expr, ast.StringLiteral) and not (
+        expr.is_raw or expr.is_bytestr or expr.is_cstr
+    )
+
+def can_join_string_literals(left, right):
+    # The literals are joined as written, so an escape sequence at the end
+    # of `left` could take the first characters of `right`: `"\0" + "12"`
+    # would become the C octal escape `\012`.
+    return is_plain_string_literal(left) and is_plain_string_literal(
+        right
+    ) and "\\" not in left.lit
+
 def prefix_type(tt):
     prefix = ""
     if isinstance(tt, type.Ptr):
@@ -124,3 +146,54 @@ def mangle_symbol(s):
 
     root.mangled_name = "".join(res)
     return root.mangled_name
+
+FMT_PLACEHOLDER = re.compile(r"\{([0-9]*)(?::(-?[0-9]+))?\}")
+
+def parse_fmt_literal(lit, is_raw, args_len):
+    """Splits the format string literal `lit` of `string.fmt` into pieces of
+    text, as written in the source (with their escape sequences), and
+    placeholders, as `(argument index, width or None)` tuples.
+
+    Returns `None` if `lit` cannot be parsed like `StringFormatter.fmt` does
+    at runtime, or if it uses an argument out of range, so the runtime
+    formatter reports it.
+    """
+    pieces = []
+    text = []
+    args_idx = 0
+    i = 0
+    while i < len(lit):
+        ch = lit[i]
+        next_ch = lit[i + 1] if i + 1 < len(lit) else ""
+        if ch == "\\" and not is_raw:
+            # a one byte escape sequence, never a brace
+            text.append(lit[i:i + 2])
+            i += 2
+        elif ch in "{}" and next_ch == ch: # escaped brace
+            text.append(ch)
+            i += 2
+        elif ch == "{":
+            match = FMT_PLACEHOLDER.match(lit, i)
+            if match == None:
+                return None
+            index, width = match.groups()
+            if index:
+                arg_idx = int(index)
+            else:
+                arg_idx = args_idx
+                args_idx += 1
+            if arg_idx >= args_len or (width != None and int(width) == 0):
+                return None
+            if len(text) > 0:
+                pieces.append("".join(text))
+                text = []
+            pieces.append((arg_idx, int(width) if width != None else None))
+            i = match.end()
+        elif ch == "}":
+            return None
+        else:
+            text.append(ch)
+            i += 1
+    if len(text) > 0:
+        pieces.append("".join(text))
+    return pieces
@@ -32,9 +32,28 @@ def get_ir_op(op):
         return None
     return op_kind
 
-class Type:
+class InternedType(type):
+    """Makes the constructors of the IR types return a single instance for
+    each distinct type, so IR types are equal only if they are the same
+    object and can be used as dictionary keys.
+    """
+    def __call__(cls, *args, **kwargs):
+        key = cls.intern_key(*args, **kwargs)
+        typ = cls.interned.get(key)
+        if typ == None:
+            typ = super().__call__(*args, **kwargs)
+            cls.interned[key] = typ
+        return typ
+
+class Type(metaclass = InternedType):
+    interned = {}
+
     def __init__(self, name):
-        self.name = name
+        self.name = str(name)
+
+    @staticmethod
+    def intern_key(name):
+        return str(name)
 
     def ptr(self, is_managed = False):
         return Pointer(self, is_managed)
@@ -45,13 +64,17 @@ class Type:
     def __str__(self):
         return self.name
 
-    def __eq__(self, other):
-        return str(self) == str(other)
+class Pointer(metaclass = InternedType):
+    interned = {}
 
-class Pointer:
     def __init__(self, typ, is_managed = False):
         self.typ = typ
         self.is_managed = is_managed
+        self.str = f"+{typ}" if is_managed else f"*{typ}"
+
+    @staticmethod
+    def intern_key(typ, is_managed = False):
+        return (typ, is_managed)
 
     def ptr(self, is_managed = False):
         return Pointer(self, is_managed)
@@ -65,15 +88,10 @@ class Pointer:
         return nr
 
     def __repr__(self):
-        return str(self)
+        return self.str
 
     def __str__(self):
-        if self.is_managed:
-            return f"+{self.typ}"
-        return f"*{self.typ}"
-
-    def __eq__(self, other):
-        return str(self) == str(other)
+        return self.str
 
 VOID_T = Type("void")
 RAWPTR_T = VOID_T.ptr()
@@ -82,6 +100,8 @@ RUNE_T = Type("rune")
 C_INT_T = Type("int")
 CHAR_T = Type("char")
 UINT8_T = Type("uint8")
+UINT16_T = Type("uint16")
+UINT32_T = Type("uint32")
 UINT64_T = Type("uint64")
 Float64_T = Type("float64")
 INT_T = Type("ri_int")
@@ -92,39 +112,49 @@ STRING_T = Type("_R4core6string")
 TEST_T = Type("_R4core4Test")
 TEST_RUNNER_T = Type("_R4core10TestRunner")
 
-class Array:
+class Array(metaclass = InternedType):
+    interned = {}
+
     def __init__(self, typ, size):
         self.typ = typ
         self.size = size
+        self.str = f"{[size]}{typ}"
+
+    @staticmethod
+    def intern_key(typ, size):
+        return (typ, str(size))
 
     def ptr(self):
         return Pointer(self)
 
     def __repr__(self):
-        return str(self)
+        return self.str
 
     def __str__(self):
-        return f"{[self.size]}{self.typ}"
+        return self.str
 
-    def __eq__(self, other):
-        return str(self) == str(other)
+class Function(metaclass = InternedType):
+    interned = {}
 
-class Function:
     def __init__(self, args, ret_typ):
-        self.args = args
+        self.args = list(args) if isinstance(args, (list, tuple)) else [args]
         self.ret_typ = ret_typ
+        self.str = f"*func({', '.join([str(arg) for arg in self.args])}) {ret_typ}"
+
+    @staticmethod
+    def intern_key(args, ret_typ):
+        if isinstance(args, (list, tuple)):
+            return (tuple(args), ret_typ)
+        return ((args, ), ret_typ)
 
     def ptr(self):
         return Pointer(self)
 
     def __repr__(self):
-        return str(self)
+        return self.str
 
     def __str__(self):
-        return f"*func({', '.join([str(arg) for arg in self.args])}) {self.ret_typ}"
-
-    def __eq__(self, other):
-        return str(self) == str(other)
+        return self.str
 
 class RIRFile:
     def __init__(self, mod_name):
@@ -234,11 +264,15 @@ class Field:
         self.typ = typ
 
 class GlobalVar:
-    def __init__(self, is_public, is_extern, typ, name):
+    def __init__(
+        self, is_public, is_extern, typ, name, value = None, is_const = False
+    ):
         self.is_public = is_public
         self.is_extern = is_extern
         self.typ = typ
         self.name = name
+        self.value = value # static initializer, a literal
+        self.is_const = is_const
 
     def __str__(self):
         if self.is_public:
@@ -247,6 +281,10 @@ class GlobalVar:
             kw = "extern "
         else:
             kw = ""
+        if self.is_const:
+            kw += "const "
+        if self.value:
+            return f'{kw}var %{self.name}: {self.typ} = {self.value}'
         return f'{kw}var %{self.name}: {self.typ}'
 
 class Local:
@@ -268,11 +306,18 @@ class FuncDecl:
         self.ret_typ = ret_typ
         self.is_never = is_never
         self.arr_ret_struct = ""
+        # the module whose C translation unit contains this function; empty
+        # for the functions generated by the compiler
+        self.mod_name = ""
 
         self.locals = []
+        self.locals_names = set()
         self.locals_nr = 0
-        self.uniq_ids = 0
+        self.uniq_ids = {} # base name -> next suffix for `unique_name`
         self.instrs = list()
+        # (alloca of a trait box, store of the copy of its value or `None`),
+        # see `opt.EscapeAnalysis`
+        self.trait_boxes = []
 
     def add_comment(self, comment):
         self.instrs.append(Comment(comment))
@@ -325,6 +370,13 @@ class FuncDecl:
     def add_cond_br(self, cond, label1, label2):
         self.add_inst(Inst(InstKind.Br, [cond, Name(label1), Name(label2)]))
 
+    def add_switch(self, value, default_label, cases):
+        # `cases` is a list of (value, label)
+        args = [value, Name(default_label)]
+        for case_value, label in cases:
+            args += [case_value, Name(label)]
+        self.add_inst(Inst(InstKind.Switch, args))
+
     def add_call(self, name, args = list()):
         args_ = [Name(name), *args]
         self.add_inst(Inst(InstKind.Call, args_))
@@ -344,22 +396,22 @@ class FuncDecl:
         )
 
     def add_local(self, name, typ):
-        if self.exists_local(name):
+        if name in self.locals_names:
             raise Exception(f"{self.name}: duplicate local name `{name}`")
         self.locals.append(Local(name, typ))
+        self.locals_names.add(name)
 
     def exists_local(self, name):
-        for local in self.locals:
-            if local.name == name:
-                return True
-        return False
+        return name in self.locals_names
 
     def unique_name(self, name):
-        if self.exists_local(name):
-            id = self.uniq_ids
-            self.uniq_ids += 1
-            return f"{name}_{id}"
-        return name
+        if name not in self.locals_names:
+            return name
+        id = self.uniq_ids.get(name, 0)
+        while f"{name}_{id}" in self.locals_names:
+            id += 1
+        self.uniq_ids[name] = id + 1
+        return f"{name}_{id}"
 
     def __str__(self):
         sb = utils.Builder()
@@ -469,6 +521,18 @@ class ArrayLit:
     def __str__(self):
         return self.__repr__()
 
+class StructLit: # Compound literal or static initializer of a struct
+    def __init__(self, typ, fields):
+        self.typ = typ
+        self.fields = fields # (name, value)
+
+    def __repr__(self):
+        fields = ", ".join([f"{name}: {value}" for name, value in self.fields])
+        return f"{self.typ} {{ {fields} }}"
+
+    def __str__(self):
+        return self.__repr__()
+
 class Ident: # Local and global values
     def __init__(self, typ, name):
         self.name = name
@@ -562,6 +626,7 @@ class InstKind(Enum):
 
     # routine operators
     Br = auto_enum()
+    Switch = auto_enum()
     Call = auto_enum()
     Ret = auto_enum()
 
@@ -592,6 +657,7 @@ class InstKind(Enum):
         elif self == InstKind.Lshift: return "lshift"
         elif self == InstKind.Rshift: return "rshift"
         elif self == InstKind.Br: return "br"
+        elif self == InstKind.Switch: return "switch"
         elif self == InstKind.Call: return "call"
         elif self == InstKind.Ret: return "ret"
         return "nop"
@@ -0,0 +1,1341 @@
+# Copyright (C) 2023 Jose Mendoza. All rights reserved.
+# Use of this source code is governed by an MIT license that can
+# be found in the LICENSE file.
+
+import re
+
+from .. import utils
+from .ir import InstKind
+from . import ir
+
+TEMP_NAME = re.compile(r"_\d+_")
+
+# C integer types: name -> (bits, is_signed); `ri_int` and `ri_uint` are
+# added by `IntTypes` with the pointer size
+INT_TYPES = {
+    "int8": (8, True), "int16": (16, True), "int32": (32, True),
+    "int64": (64, True), "uint8": (8, False), "uint16": (16, False),
+    "uint32": (32, False), "uint64": (64, False), "bool": (8, False),
+    "rune": (32, False), "int": (32, True)
+}
+
+ARITH_OPS = {
+    InstKind.Add: lambda a, b: a + b,
+    InstKind.Sub: lambda a, b: a - b,
+    InstKind.Mult: lambda a, b: a * b,
+    InstKind.BitAnd: lambda a, b: a & b,
+    InstKind.BitOr: lambda a, b: a | b,
+    InstKind.BitXor: lambda a, b: a ^ b
+}
+
+CMP_OPS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    ">": lambda a, b: a > b,
+    "<=": lambda a, b: a <= b,
+    ">=": lambda a, b: a >= b
+}
+
+# instructions whose first argument is written, not read
+LVALUE_INSTS = (InstKind.Store, InstKind.Inc, InstKind.Dec, InstKind.GetPtr)
+
+# the C backend does not wrap these instructions in parentheses, so they can
+# only be moved to where a full expression is expected
+UNWRAPPED_INSTS = (
+    InstKind.Store, InstKind.StorePtr, InstKind.Cmp, InstKind.Add,
+    InstKind.Sub, InstKind.Mult, InstKind.Div, InstKind.Mod, InstKind.BitAnd,
+    InstKind.BitOr, InstKind.BitXor, InstKind.Lshift, InstKind.Rshift,
+    InstKind.Inc, InstKind.Dec
+)
+
+# instruction -> the arguments that the C backend generates as full
+# expressions
+FULL_EXPR_ARGS = {
+    InstKind.Alloca: (1, ), InstKind.Store: (1, ), InstKind.StorePtr: (1, ),
+    InstKind.Ret: (0, ), InstKind.Br: (0, ), InstKind.Switch: (0, ),
+    InstKind.Cast: (0, ),
+    InstKind.LoadPtr: (0, ), InstKind.Neg: (0, ), InstKind.BitNot: (0, ),
+    InstKind.BooleanNot: (0, )
+}
+
+def children(value):
+    if isinstance(value, ir.Inst):
+        return value.args
+    elif isinstance(value, ir.Selector):
+        return [value.left]
+    elif isinstance(value, ir.ArrayLit):
+        return value.elems
+    elif isinstance(value, ir.StructLit):
+        return [field_value for _, field_value in value.fields]
+    return []
+
+def walk(value):
+    # Yields `value` and all its subvalues.
+    stack = [value]
+    while len(stack) > 0:
+        value = stack.pop()
+        yield value
+        stack += children(value)
+
+def has_effects(value):
+    for v in walk(value):
+        if isinstance(v, ir.Inst) and v.kind in (
+            InstKind.Call, InstKind.Inc, InstKind.Dec, InstKind.Store,
+            InstKind.StorePtr
+        ):
+            return True
+    return False
+
+def ident_name(value):
+    # Returns the name of the local that is the base of the lvalue `value`,
+    # if the lvalue is the local itself or one of its fields (not through a
+    # pointer).
+    while isinstance(value, ir.Selector):
+        if isinstance(value.left.typ, ir.Pointer):
+            return None
+        value = value.left
+    if isinstance(value, ir.Ident):
+        return value.name
+    return None
+
+def replace(value, name, new):
+    # Returns a copy of `value` where the `Ident` called `name` is replaced
+    # by `new`; the subvalues are shared between functions, so the changed
+    # path is copied instead of updated.
+    if isinstance(value, ir.Ident):
+        return new if value.name == name else value
+    elif isinstance(value, ir.Inst):
+        return ir.Inst(
+            value.kind, [replace(arg, name, new) for arg in value.args],
+            value.typ
+        )
+    elif isinstance(value, ir.Selector):
+        return ir.Selector(value.typ, replace(value.left, name, new), value.name)
+    elif isinstance(value, ir.ArrayLit):
+        return ir.ArrayLit(
+            value.typ, [replace(elem, name, new) for elem in value.elems]
+        )
+    elif isinstance(value, ir.StructLit):
+        return ir.StructLit(
+            value.typ, [(field_name, replace(field_value, name, new))
+                        for field_name, field_value in value.fields]
+        )
+    return value
+
+def label_args(inst):
+    # Returns the indexes of the labels used by the branch `inst`.
+    if inst.kind == InstKind.Br:
+        return range(0 if len(inst.args) == 1 else 1, len(inst.args))
+    elif inst.kind == InstKind.Switch:
+        return range(1, len(inst.args), 2)
+    return range(0)
+
+def count_instrs(decls):
+    count = 0
+    for decl in decls:
+        if isinstance(decl, ir.FuncDecl):
+            for inst in decl.instrs:
+                if isinstance(inst, (ir.Inst, ir.Label)):
+                    count += 1
+    return count
+
+class IntTypes:
+    def __init__(self, pointer_size):
+        self.types = dict(INT_TYPES)
+        self.types["ri_int"] = (pointer_size * 8, True)
+        self.types["ri_uint"] = (pointer_size * 8, False)
+        self.ir_types = {}
+        for name in self.types:
+            self.ir_types[name] = ir.Type(name)
+
+    def info(self, typ):
+        if isinstance(typ, ir.Type):
+            return self.types.get(typ.name)
+        return None
+
+    def promote(self, typ):
+        # C integer promotions: types smaller than `int` become `int`
+        bits, _ = self.types[typ.name]
+        return ir.C_INT_T if bits < 32 else typ
+
+    def common_type(self, left, right):
+        # C usual arithmetic conversions
+        left, right = self.promote(left), self.promote(right)
+        if left is right:
+            return left
+        l_bits, l_signed = self.types[left.name]
+        r_bits, r_signed = self.types[right.name]
+        if l_signed == r_signed:
+            return left if l_bits >= r_bits else right
+        unsigned, signed = (right, left) if l_signed else (left, right)
+        u_bits, _ = self.types[unsigned.name]
+        s_bits, _ = self.types[signed.name]
+        if u_bits >= s_bits:
+            return unsigned
+        return signed
+
+    def wrap(self, value, typ):
+        bits, is_signed = self.types[typ.name]
+        value &= (1 << bits) - 1
+        if is_signed and value >= 1 << (bits - 1):
+            value -= 1 << bits
+        return value
+
+# the largest function (in instructions) that is inlined, and the largest
+# size that a function can reach by inlining calls
+INLINE_BUDGET = 12
+CALLER_BUDGET = 2000
+
+class Inliner:
+    """Replaces the calls to `#[inline]` functions with their bodies.
+
+    Only the calls that are a whole instruction are inlined: a call
+    statement, a local initialized or assigned with the result, or a
+    returned call. The arguments are saved in new locals, so they are
+    evaluated once and in order, as in the call. The callees are inlined
+    into first, so the budgets apply to their final size.
+    """
+    def __init__(self, decls):
+        self.funcs = {}
+        for decl in decls:
+            if isinstance(decl, ir.FuncDecl) and not decl.is_extern:
+                self.funcs[decl.name] = decl
+        self.done = set()
+        self.in_progress = set()
+        self.inlined_calls = 0
+
+    def run(self):
+        for decl in self.funcs.values():
+            self.inline_calls(decl)
+        return self.inlined_calls
+
+    def size(self, decl):
+        size = 0
+        for inst in decl.instrs:
+            if isinstance(inst, ir.Inst) and inst.kind != InstKind.DbgStmtLine:
+                size += 1
+        return size
+
+    def can_inline(self, callee):
+        if callee.is_variadic or callee.is_never or callee.arr_ret_struct:
+            return False
+        elif any(isinstance(arg.typ, ir.Array) for arg in callee.args):
+            return False
+        return self.size(callee) <= INLINE_BUDGET
+
+    def inline_calls(self, decl):
+        if decl.name in self.done:
+            return
+        self.in_progress.add(decl.name)
+        size = self.size(decl)
+        instrs = []
+        for inst in decl.instrs:
+            call, callee = self.call_site(inst)
+            if callee and callee.name not in self.in_progress:
+                self.inline_calls(callee)
+                if self.can_inline(callee) and self.fits(
+                    decl, inst, callee
+                ) and size + self.size(callee) <= CALLER_BUDGET:
+                    instrs += self.expand(decl, inst, call, callee)
+                    size += self.size(callee)
+                    self.inlined_calls += 1
+                    continue
+            instrs.append(inst)
+        decl.instrs = instrs
+        self.in_progress.remove(decl.name)
+        self.done.add(decl.name)
+
+    def call_site(self, inst):
+        # Returns the call made by `inst` and the `#[inline]` function called.
+        if not isinstance(inst, ir.Inst):
+            return None, None
+        if inst.kind == InstKind.Call:
+            call = inst
+        elif inst.kind in (InstKind.Alloca, InstKind.Store, InstKind.Ret) and len(
+            inst.args
+        ) > 0 and isinstance(inst.args[-1], ir.Inst) and inst.args[
+            -1].kind == InstKind.Call:
+            call = inst.args[-1]
+            if inst.kind == InstKind.Store and not isinstance(
+                inst.args[0], ir.Ident
+            ):
+                return None, None
+        else:
+            return None, None
+        callee = self.funcs.get(str(call.args[0]))
+        if callee and callee.attrs.has("inline"):
+            return call, callee
+        return None, None
+
+    def fits(self, decl, inst, callee):
+        # the result must be converted the same way as with the call
+        if inst.kind in (InstKind.Alloca, InstKind.Store):
+            return inst.args[0].typ is callee.ret_typ
+        elif inst.kind == InstKind.Ret:
+            return decl.ret_typ is callee.ret_typ
+        return True
+
+    def expand(self, decl, inst, call, callee):
+        renames = {}
+        for arg in callee.args:
+            renames[arg.name] = decl.local_name()
+        labels = {}
+        for callee_inst in callee.instrs:
+            if isinstance(callee_inst, ir.Label):
+                labels[callee_inst.label] = decl.local_name()
+            elif isinstance(
+                callee_inst, ir.Inst
+            ) and callee_inst.kind == InstKind.Alloca:
+                renames[callee_inst.args[0].name] = decl.local_name()
+        instrs = [ir.Comment(f"inlined call to `{callee.name}`")]
+        for arg, value in zip(callee.args, call.args[1:]):
+            name = renames[arg.name]
+            decl.add_local(name, arg.typ)
+            instrs.append(
+                ir.Inst(InstKind.Alloca, [ir.Ident(arg.typ, name), value])
+            )
+
+        body = [
+            callee_inst for callee_inst in callee.instrs
+            if not (
+                isinstance(callee_inst, ir.Comment) or isinstance(
+                    callee_inst, ir.Inst
+                ) and callee_inst.kind == InstKind.DbgStmtLine
+            )
+        ]
+        rets = [
+            callee_inst for callee_inst in body if isinstance(
+                callee_inst, ir.Inst
+            ) and callee_inst.kind == InstKind.Ret
+        ]
+        # with a single `ret` at the end, the result is used in place
+        is_single_ret = len(rets) == 1 and body[-1] is rets[0]
+        end_label = "" if is_single_ret else decl.local_name()
+        if inst.kind == InstKind.Alloca and not is_single_ret:
+            instrs.append(ir.Inst(InstKind.Alloca, [inst.args[0]]))
+        for callee_inst in body:
+            if isinstance(callee_inst, ir.Label):
+                instrs.append(ir.Label(labels[callee_inst.label]))
+                continue
+            new_inst = self.rename(callee_inst, renames)
+            if new_inst.kind == InstKind.Alloca:
+                decl.add_local(new_inst.args[0].name, new_inst.args[0].typ)
+            elif new_inst.kind in (InstKind.Br, InstKind.Switch):
+                for i in label_args(new_inst):
+                    new_inst.args[i] = ir.Name(labels[new_inst.args[i].name])
+            elif new_inst.kind == InstKind.Ret:
+                instrs += self.result(decl, inst, new_inst, is_single_ret)
+                if not is_single_ret:
+                    instrs.append(ir.Inst(InstKind.Br, [ir.Name(end_label)]))
+                continue
+            instrs.append(new_inst)
+        if not is_single_ret:
+            instrs.append(ir.Label(end_label))
+        return instrs
+
+    def result(self, decl, inst, ret, is_single_ret):
+        # The instructions that replace the `ret` of the callee.
+        if inst.kind == InstKind.Ret:
+            return [ret]
+        elif len(ret.args) == 0:
+            return []
+        value = ret.args[0]
+        if inst.kind == InstKind.Alloca:
+            if is_single_ret:
+                return [ir.Inst(InstKind.Alloca, [inst.args[0], value])]
+            return [ir.Inst(InstKind.Store, [inst.args[0], value])]
+        elif inst.kind == InstKind.Store:
+            return [ir.Inst(InstKind.Store, [inst.args[0], value])]
+        elif has_effects(value):
+            # the result of a call statement is discarded
+            if isinstance(value, ir.Inst) and value.kind == InstKind.Call:
+                return [value]
+            name = decl.local_name()
+            decl.add_local(name, ret.args[0].typ)
+            return [
+                ir.Inst(
+                    InstKind.Alloca, [ir.Ident(ret.args[0].typ, name), value]
+                )
+            ]
+        return []
+
+    def rename(self, value, renames):
+        # Returns a copy of `value` that uses the new names of the locals.
+        if isinstance(value, ir.Ident):
+            if name := renames.get(value.name):
+                return ir.Ident(value.typ, name)
+            return value
+        elif isinstance(value, ir.Inst):
+            return ir.Inst(
+                value.kind, [self.rename(arg, renames) for arg in value.args],
+                value.typ
+            )
+        elif isinstance(value, ir.Selector):
+            return ir.Selector(
+                value.typ, self.rename(value.left, renames), value.name
+            )
+        elif isinstance(value, ir.ArrayLit):
+            return ir.ArrayLit(
+                value.typ, [self.rename(elem, renames) for elem in value.elems]
+            )
+        elif isinstance(value, ir.StructLit):
+            return ir.StructLit(
+                value.typ, [(name, self.rename(field_value, renames))
+                            for name, field_value in value.fields]
+            )
+        return value
+
+# Taints are tracked by pointer depth: a value with taint level `k` is a
+# pointer to a stack object, or a pointer whose pointed values are tainted
+# with level `k - 1`. The last level is sticky: loading through it keeps it.
+TAINT_LEVELS = 5
+UNTAINTED = (0, ) * TAINT_LEVELS
+
+# C functions that neither keep nor return the pointers passed to them,
+# beyond the contents copied by `memcpy` and `memmove` from their second
+# argument
+NO_CAPTURE_FUNCS = {
+    "memcpy", "memmove", "memset", "memcmp", "strlen", "strcmp", "strncmp",
+    "write", "fwrite", "fputs", "fflush", "isatty", "access", "wyhash",
+    "wyhash64"
+}
+COPY_FUNCS = {"memcpy", "memmove"}
+
+SCALAR_TYPES = set(INT_TYPES) | {"ri_int", "ri_uint", "float32", "float64"}
+
+def taint_union(a, b):
+    if b is UNTAINTED:
+        return a
+    elif a is UNTAINTED:
+        return b
+    return tuple(x | y for x, y in zip(a, b))
+
+def taint_load(t):
+    # the taint of the values pointed by a value tainted with `t`
+    if t is UNTAINTED or t[1] == 0:
+        return UNTAINTED
+    return t[1:] + t[-1:]
+
+def taint_ref(t):
+    # the taint of a pointer to a value tainted with `t`
+    if t is UNTAINTED:
+        return UNTAINTED
+    return t[:1] + t[:-1]
+
+def is_scalar(typ):
+    return isinstance(typ, ir.Type) and typ.name in SCALAR_TYPES
+
+class EscapeAnalysis:
+    """Moves to the stack the trait boxes that cannot outlive the function
+    that creates them.
+
+    `Codegen.trait_value` allocates every trait object, and a copy of the
+    value it wraps, on the heap. Each function is summarized with the
+    arguments that it may store where they outlive the call (a global, the
+    heap, an unknown function) and the arguments that it may return; the
+    summaries are computed for all the functions until they do not change,
+    starting from "nothing escapes", so recursive calls are handled. Trait
+    method calls use the summaries of all the implementations in the
+    virtual table. A box is moved to the stack when it does not escape, it
+    is not returned and no other local can hold it, so it is dead before its
+    allocation runs again, e.g. in a loop.
+    """
+    def __init__(self, decls):
+        self.funcs = {}
+        self.vtables = {}
+        for decl in decls:
+            if isinstance(decl, ir.FuncDecl) and not decl.is_extern:
+                self.funcs[decl.name] = decl
+            elif isinstance(decl, ir.VTable):
+                self.vtables[decl.name] = decl
+        # function -> (escaping args, returned args), with a bit for each
+        # argument and taint level, see `arg_bit`
+        self.summaries = {}
+        self.escapes = 0
+        self.returns = UNTAINTED
+
+    def run(self):
+        self.summarize()
+        stack_boxes = 0
+        for decl in self.funcs.values():
+            if len(decl.trait_boxes) > 0:
+                stack_boxes += self.stack_boxes(decl)
+        return stack_boxes
+
+    def arg_bit(self, i, level):
+        return 1 << (i * TAINT_LEVELS + level)
+
+    def summarize(self):
+        callers = {}
+        for decl in self.funcs.values():
+            self.summaries[decl.name] = (0, UNTAINTED)
+            for inst in decl.instrs:
+                for value in walk(inst):
+                    if isinstance(value, ir.Inst) and value.kind == InstKind.Call:
+                        for name in self.callees(value.args[0]) or ():
+                            callers.setdefault(name, set()).add(decl.name)
+        worklist = list(self.funcs)
+        pending = set(worklist)
+        while len(worklist) > 0:
+            name = worklist.pop()
+            pending.remove(name)
+            decl = self.funcs[name]
+            seeds = {}
+            for i, arg in enumerate(decl.args):
+                if not is_scalar(arg.typ):
+                    # the argument tainted with all the levels at once
+                    seeds[arg.name] = tuple(
+                        sum(
+                            self.arg_bit(i, level)
+                            for level in range(depth, TAINT_LEVELS)
+                        ) for depth in range(TAINT_LEVELS)
+                    )
+            if len(seeds) == 0:
+                continue
+            escapes, returns, _ = self.analyze(decl, seeds)
+            if (escapes, returns) != self.summaries[name]:
+                self.summaries[name] = (escapes, returns)
+                for caller in callers.get(name, ()):
+                    if caller not in pending:
+                        pending.add(caller)
+                        worklist.append(caller)
+
+    def callees(self, value):
+        # Returns the names of the functions that can be called by `value`,
+        # or `None` if they are unknown.
+        if isinstance(value, (str, ir.Name)):
+            return [str(value)]
+        elif isinstance(value, ir.Selector) and isinstance(
+            value.left, ir.Inst
+        ) and value.left.kind == InstKind.LoadPtr:
+            vtbl = value.left.args[0]
+            if isinstance(vtbl, ir.Inst) and vtbl.kind == InstKind.Add and isinstance(
+                vtbl.args[0], ir.Name
+            ) and (vtable := self.vtables.get(vtbl.args[0].name)):
+                names = []
+                for funcs in vtable.funcs:
+                    if value.name.name not in funcs:
+                        return None
+                    names.append(funcs[value.name.name])
+                return names
+        return None
+
+    def analyze(self, decl, seeds):
+        # Returns the taints that escape from `decl` and that are returned,
+        # and the taints of its locals, when the locals of `seeds` start
+        # with the given taints.
+        self.escapes = 0
+        self.returns = UNTAINTED
+        taints = dict(seeds)
+        locals = set(arg.name for arg in decl.args)
+        for inst in decl.instrs:
+            if isinstance(inst, ir.Inst) and inst.kind == InstKind.Alloca:
+                locals.add(inst.args[0].name)
+        changed = True
+        while changed:
+            changed = False
+            for inst in decl.instrs:
+                if not isinstance(inst, ir.Inst):
+                    continue
+                if inst.kind == InstKind.Alloca:
+                    if len(inst.args) == 2:
+                        t = self.taint(inst.args[1], taints)
+                        changed |= self.add_taint(taints, inst.args[0].name, t)
+                elif inst.kind == InstKind.Store:
+                    self.taint(inst.args[0], taints)
+                    t = self.taint(inst.args[1], taints)
+                    if t is not UNTAINTED:
+                        name = ident_name(inst.args[0])
+                        if name in locals:
+                            changed |= self.add_taint(taints, name, t)
+                        else:
+                            self.escapes |= t[0]
+                elif inst.kind == InstKind.StorePtr:
+                    self.taint(inst.args[0], taints)
+                    self.escapes |= self.taint(inst.args[1], taints)[0]
+                elif inst.kind == InstKind.Ret:
+                    if len(inst.args) > 0:
+                        self.returns = taint_union(
+                            self.returns, self.taint(inst.args[0], taints)
+                        )
+                else:
+                    self.taint(inst, taints)
+        return self.escapes, self.returns, taints
+
+    def add_taint(self, taints, name, t):
+        if t is UNTAINTED:
+            return False
+        old = taints.get(name, UNTAINTED)
+        new = taint_union(old, t)
+        if new == old:
+            return False
+        taints[name] = new
+        return True
+
+    def taint(self, value, taints):
+        # Returns the taint of `value`; the arguments of the calls made by
+        # `value` that escape are added to `self.escapes`.
+        if isinstance(value, ir.Ident):
+            # not filtered by type: it can hold a pointer cast to an integer
+            return taints.get(value.name, UNTAINTED)
+        elif isinstance(value, ir.Selector):
+            t = self.taint(value.left, taints)
+            if isinstance(getattr(value.left, "typ", None), ir.Pointer):
+                t = taint_load(t)
+        elif isinstance(value, ir.ArrayLit):
+            # used as a pointer to its first element
+            t = UNTAINTED
+            for elem in value.elems:
+                t = taint_union(t, self.taint(elem, taints))
+            t = taint_ref(t)
+        elif isinstance(value, ir.StructLit):
+            t = UNTAINTED
+            for _, field_value in value.fields:
+                t = taint_union(t, self.taint(field_value, taints))
+        elif isinstance(value, ir.Inst):
+            if value.kind == InstKind.Call:
+                t = self.call_taint(value, taints)
+            else:
+                t = UNTAINTED
+                for arg in value.args:
+                    t = taint_union(t, self.taint(arg, taints))
+                if value.kind == InstKind.LoadPtr:
+                    t = taint_load(t)
+                elif value.kind == InstKind.GetPtr:
+                    t = taint_ref(t)
+                elif value.kind == InstKind.Cast:
+                    # pointers cast to integers are still pointers
+                    return t
+        else:
+            return UNTAINTED
+        return UNTAINTED if is_scalar(value.typ) else t
+
+    def call_taint(self, call, taints):
+        callee = call.args[0]
+        if not isinstance(callee, (str, ir.Name)):
+            self.taint(callee, taints)
+        arg_taints = [self.taint(arg, taints) for arg in call.args[1:]]
+        if all(t is UNTAINTED for t in arg_taints):
+            return UNTAINTED
+        names = self.callees(callee)
+        result = [0] * TAINT_LEVELS
+        for i, t in enumerate(arg_taints):
+            if t is UNTAINTED:
+                continue
+            for name in names or [None]:
+                if name in self.funcs and i < len(self.funcs[name].args):
+                    escapes, returns = self.summaries[name]
+                    for level in range(TAINT_LEVELS):
+                        # the taints that are exactly `level`
+                        bits = t[level] & ~(
+                            t[level + 1] if level + 1 < TAINT_LEVELS else 0
+                        )
+                        bit = self.arg_bit(i, level)
+                        if bits == 0:
+                            continue
+                        elif escapes & bit:
+                            self.escapes |= bits
+                        for depth in range(TAINT_LEVELS):
+                            if returns[depth] & bit:
+                                result[depth] |= bits
+                elif name in NO_CAPTURE_FUNCS:
+                    if name in COPY_FUNCS and i == 1:
+                        self.escapes |= taint_load(t)[0]
+                    for depth in range(TAINT_LEVELS):
+                        result[depth] |= t[0]
+                else:
+                    self.escapes |= t[0]
+                    for depth in range(TAINT_LEVELS):
+                        result[depth] |= t[0]
+        return tuple(result)
+
+    def stack_boxes(self, decl):
+        seeds = {}
+        for i, (box, _) in enumerate(decl.trait_boxes):
+            # the box points to the copy of the value
+            seeds[box.args[0].name] = (1 << i, 1 << i) + (0, ) * (
+                TAINT_LEVELS - 2
+            )
+        escapes, returns, taints = self.analyze(decl, seeds)
+        held = escapes | returns[0]
+        for name, t in taints.items():
+            held |= t[0] & ~seeds.get(name, UNTAINTED)[0]
+        stack_boxes = 0
+        for i, (box, value_store) in enumerate(decl.trait_boxes):
+            if held & (1 << i):
+                continue
+            tmp = box.args[0]
+            obj = ir.Ident(tmp.typ.typ, decl.local_name())
+            decl.add_local(obj.name, obj.typ)
+            self.replace_inst(
+                decl, box, [
+                    ir.Inst(InstKind.Alloca, [obj]),
+                    ir.Inst(
+                        InstKind.Alloca,
+                        [tmp, ir.Inst(InstKind.GetPtr, [obj], tmp.typ)]
+                    )
+                ]
+            )
+            if value_store:
+                # `raw_dup(get_ref value, size)`
+                value = value_store.args[1].args[1].args[0]
+                copy = ir.Ident(value.typ, decl.local_name())
+                decl.add_local(copy.name, copy.typ)
+                self.replace_inst(
+                    decl, value_store, [
+                        ir.Inst(InstKind.Alloca, [copy, value]),
+                        ir.Inst(
+                            InstKind.Store, [
+                                value_store.args[0],
+                                ir.Inst(
+                                    InstKind.GetPtr, [copy], copy.typ.ptr()
+                                )
+                            ]
+                        )
+                    ]
+                )
+            stack_boxes += 1
+        decl.trait_boxes = []
+        return stack_boxes
+
+    def replace_inst(self, decl, inst, new_instrs):
+        for i, old in enumerate(decl.instrs):
+            if old is inst:
+                decl.instrs[i:i + 1] = new_instrs
+                return
+
+class PassManager:
+    """Runs optimization passes over the instructions of the RIR functions.
+
+    The passes only make local rewrites that keep the C semantics of the
+    generated code (integer promotions included):
+
+    * `escape`: allocates on the stack the trait boxes that do not escape,
+      see `EscapeAnalysis`.
+    * `inline`: inlines the calls to `#[inline]` functions, see `Inliner`.
+    * `devirt`: calls the implementation of a trait method directly when
+      the virtual table index of the receiver is known (it was boxed in the
+      same function) or all the implementations are the same function.
+    * `fold`: folds the arithmetic, comparisons and casts of integer
+      literals.
+    * `copy-prop`: moves the value of a temporary used only once into the
+      next instruction, when it is the one that uses it.
+    * `dead-temps`: removes the temporaries (and the stores to them) that
+      are never read.
+    * `jump-threading`: redirects branches to labels that only branch again,
+      and removes unreachable instructions, branches to the next label and
+      unused labels.
+    """
+    def __init__(self, comp, passes):
+        self.comp = comp
+        self.passes = passes
+        self.int_types = IntTypes(comp.pointer_size)
+        self.changes = {}
+        for name in passes:
+            self.changes[name] = 0
+
+    def run(self, rir):
+        before = count_instrs(rir.decls)
+        if "escape" in self.passes:
+            self.changes["escape"] = EscapeAnalysis(rir.decls).run()
+        if "inline" in self.passes:
+            self.changes["inline"] = Inliner(rir.decls).run()
+        self.funcs = {}
+        self.vtables = {}
+        for decl in rir.decls:
+            if isinstance(decl, ir.FuncDecl):
+                self.funcs[decl.name] = decl
+            elif isinstance(decl, ir.VTable):
+                self.vtables[decl.name] = decl
+        for decl in rir.decls:
+            if isinstance(decl, ir.FuncDecl):
+                self.run_on_func(decl)
+        after = count_instrs(rir.decls)
+        for name, changes in self.changes.items():
+            self.comp.vlog(f"opt: `{name}` made {changes} change(s)")
+        self.comp.vlog(f"opt: {before} instructions before, {after} after")
+        return before, after
+
+    def run_on_func(self, decl):
+        for name in self.passes:
+            if name == "devirt":
+                self.changes[name] += self.devirt(decl)
+            elif name == "fold":
+                self.changes[name] += self.fold(decl)
+            elif name == "copy-prop":
+                self.changes[name] += self.copy_prop(decl)
+            elif name == "dead-temps":
+                self.changes[name] += self.dead_temps(decl)
+            elif name == "jump-threading":
+                self.changes[name] += self.jump_threading(decl)
+
+    # ---- devirtualization ----
+
+    def devirt(self, decl):
+        box_ids = self.box_ids(decl)
+        changes = 0
+        for i, inst in enumerate(decl.instrs):
+            if isinstance(inst, ir.Inst):
+                new_inst, inst_changes = self.devirt_value(inst, box_ids)
+                if inst_changes > 0:
+                    decl.instrs[i] = new_inst
+                    changes += inst_changes
+        return changes
+
+    def box_ids(self, decl):
+        # Returns the virtual table index of the trait boxes of `decl`, by
+        # the locals that hold them. Only `trait_value` stores `_id_`, once
+        # for each new box; a local defined once with another local (after
+        # inlining, an argument) holds the same box.
+        defs = {}
+        aliases = {}
+        id_stores = {}
+        for inst in decl.instrs:
+            if not isinstance(inst, ir.Inst):
+                continue
+            for value in walk(inst):
+                if isinstance(value, ir.Inst) and value.kind == InstKind.GetPtr and isinstance(
+                    value.args[0], ir.Ident
+                ):
+                    # it can be changed through the pointer
+                    defs[value.args[0].name] = 2
+            if inst.kind == InstKind.Alloca:
+                name = inst.args[0].name
+                defs[name] = defs.get(name, 0) + 1
+                if len(inst.args) == 2 and isinstance(inst.args[1], ir.Ident):
+                    aliases[name] = inst.args[1].name
+            elif inst.kind in (InstKind.Store, InstKind.Inc, InstKind.Dec):
+                lvalue = inst.args[0]
+                if isinstance(lvalue, ir.Ident):
+                    defs[lvalue.name] = defs.get(lvalue.name, 0) + 1
+                elif isinstance(lvalue, ir.Selector) and str(
+                    lvalue.name
+                ) == "_id_" and isinstance(lvalue.left, ir.Ident):
+                    id_stores.setdefault(lvalue.left.name, []).append(
+                        inst.args[1]
+                    )
+        box_ids = {}
+        for name in defs:
+            box = name
+            seen = {name}
+            while box in aliases and box not in id_stores:
+                box = aliases[box]
+                if defs.get(box) != 1 or box in seen:
+                    break
+                seen.add(box)
+            if defs.get(box) == 1 and defs[name] == 1:
+                stores = id_stores.get(box, [])
+                if len(stores) == 1 and isinstance(stores[0], ir.IntLit):
+                    box_ids[name] = int(stores[0].lit, 0)
+        return box_ids
+
+    def devirt_value(self, value, box_ids):
+        # Returns a copy of `value` with the trait method calls that can be
+        # made directly replaced, and the number of them.
+        changes = 0
+        if isinstance(value, ir.Inst):
+            args = []
+            for arg in value.args:
+                new_arg, arg_changes = self.devirt_value(arg, box_ids)
+                args.append(new_arg)
+                changes += arg_changes
+            if value.kind == InstKind.Call and (
+                func := self.impl_method(value, box_ids)
+            ):
+                args[0] = ir.Name(func)
+                changes += 1
+            if changes > 0:
+                return ir.Inst(value.kind, args, value.typ), changes
+        elif isinstance(value, ir.Selector):
+            left, changes = self.devirt_value(value.left, box_ids)
+            if changes > 0:
+                return ir.Selector(value.typ, left, value.name), changes
+        elif isinstance(value, ir.ArrayLit):
+            elems = []
+            for elem in value.elems:
+                new_elem, elem_changes = self.devirt_value(elem, box_ids)
+                elems.append(new_elem)
+                changes += elem_changes
+            if changes > 0:
+                return ir.ArrayLit(value.typ, elems), changes
+        elif isinstance(value, ir.StructLit):
+            fields = []
+            for name, field_value in value.fields:
+                new_value, value_changes = self.devirt_value(
+                    field_value, box_ids
+                )
+                fields.append((name, new_value))
+                changes += value_changes
+            if changes > 0:
+                return ir.StructLit(value.typ, fields), changes
+        return value, 0
+
+    def impl_method(self, call, box_ids):
+        # Returns the function called by the trait method call `call`, if it
+        # is known: `load_ptr add <Trait>4VTBL, <index>.<method>(...)`.
+        callee = call.args[0]
+        if not (
+            isinstance(callee, ir.Selector) and isinstance(callee.left, ir.Inst)
+            and callee.left.kind == InstKind.LoadPtr
+        ):
+            return None
+        vtbl = callee.left.args[0]
+        if not (
+            isinstance(vtbl, ir.Inst) and vtbl.kind == InstKind.Add
+            and isinstance(vtbl.args[0], ir.Name)
+        ):
+            return None
+        vtable = self.vtables.get(vtbl.args[0].name)
+        if vtable == None:
+            return None
+        method = str(callee.name)
+        index = vtbl.args[1]
+        if isinstance(index, ir.Selector) and isinstance(
+            index.left, ir.Ident
+        ) and str(index.name) == "_id_" and index.left.name in box_ids:
+            idx = box_ids[index.left.name]
+            if idx >= len(vtable.funcs):
+                return None
+            funcs = {vtable.funcs[idx].get(method)}
+        else:
+            # the index is not evaluated anymore, it must be a plain load
+            if has_effects(index):
+                return None
+            funcs = {impl.get(method) for impl in vtable.funcs}
+        if len(funcs) != 1:
+            return None
+        func = self.funcs.get(funcs.pop())
+        if func == None or len(func.args) != len(call.args) - 1:
+            return None
+        elif not isinstance(func.args[0].typ, ir.Pointer):
+            # `self` is taken by value, but the call passes the object pointer
+            return None
+        elif func.args[0].typ.typ == ir.Type(vtable.trait_name):
+            # default methods take the trait object, not the value
+            return None
+        return func.name
+
+    # ---- constant folding ----
+
+    def fold(self, decl):
+        changes = 0
+        for i, inst in enumerate(decl.instrs):
+            if isinstance(inst, ir.Inst):
+                # the instructions of the function are statements, only their
+                # arguments are folded
+                args = [self.fold_value(arg) for arg in inst.args]
+                if any(new is not old for new, old in zip(args, inst.args)):
+                    decl.instrs[i] = ir.Inst(inst.kind, args, inst.typ)
+                    changes += 1
+        return changes
+
+    def fold_value(self, value):
+        if isinstance(value, ir.Selector):
+            left = self.fold_value(value.left)
+            if left is not value.left:
+                return ir.Selector(value.typ, left, value.name)
+            return value
+        elif isinstance(value, ir.ArrayLit):
+            elems = [self.fold_value(elem) for elem in value.elems]
+            if any(new is not old for new, old in zip(elems, value.elems)):
+                return ir.ArrayLit(value.typ, elems)
+            return value
+        elif isinstance(value, ir.StructLit):
+            fields = [(name, self.fold_value(field_value))
+                      for name, field_value in value.fields]
+            if any(
+                new is not old
+                for (_, new), (_, old) in zip(fields, value.fields)
+            ):
+                return ir.StructLit(value.typ, fields)
+            return value
+        elif not isinstance(value, ir.Inst):
+            return value
+        args = [self.fold_value(arg) for arg in value.args]
+        if any(new is not old for new, old in zip(args, value.args)):
+            value = ir.Inst(value.kind, args, value.typ)
+        if value.kind in LVALUE_INSTS:
+            return value
+        if lit := self.fold_inst(value):
+            return lit
+        return value
+
+    def int_lit(self, value):
+        # Returns the type and value of the integer literal `value`
+        if isinstance(value, ir.IntLit) and self.int_types.info(value.typ):
+            try:
+                return value.typ, value.value()
+            except ValueError:
+                return None
+        return None
+
+    def fold_inst(self, inst):
+        kind = inst.kind
+        int_types = self.int_types
+        if kind == InstKind.Cast:
+            arg = self.int_lit(inst.args[0])
+            if arg and int_types.info(inst.args[1]):
+                typ = inst.args[1]
+                return self.new_int_lit(typ, int_types.wrap(arg[1], typ))
+        elif kind in (InstKind.Neg, InstKind.BitNot, InstKind.BooleanNot):
+            arg = self.int_lit(inst.args[0])
+            if arg == None:
+                return None
+            if kind == InstKind.BooleanNot:
+                return self.new_int_lit(ir.BOOL_T, int(arg[1] == 0))
+            typ = int_types.promote(arg[0])
+            value = -arg[1] if kind == InstKind.Neg else ~arg[1]
+            return self.new_int_lit(typ, int_types.wrap(value, typ))
+        elif kind == InstKind.Cmp:
+            left, right = self.int_lit(inst.args[1]), self.int_lit(inst.args[2])
+            op = CMP_OPS.get(str(inst.args[0]))
+            if left == None or right == None or op == None:
+                return None
+            typ = int_types.common_type(left[0], right[0])
+            result = op(
+                int_types.wrap(left[1], typ), int_types.wrap(right[1], typ)
+            )
+            return self.new_int_lit(ir.BOOL_T, int(result))
+        elif kind in ARITH_OPS or kind in (
+            InstKind.Div, InstKind.Mod, InstKind.Lshift, InstKind.Rshift
+        ):
+            left, right = self.int_lit(inst.args[0]), self.int_lit(inst.args[1])
+            if left == None or right == None:
+                return None
+            if kind in (InstKind.Lshift, InstKind.Rshift):
+                typ = int_types.promote(left[0])
+                bits, _ = int_types.types[typ.name]
+                a = int_types.wrap(left[1], typ)
+                b = right[1]
+                if a < 0 or b < 0 or b >= bits:
+                    return None
+                value = a << b if kind == InstKind.Lshift else a >> b
+                return self.new_int_lit(typ, int_types.wrap(value, typ))
+            typ = int_types.common_type(left[0], right[0])
+            a = int_types.wrap(left[1], typ)
+            b = int_types.wrap(right[1], typ)
+            if kind in ARITH_OPS:
+                value = ARITH_OPS[kind](a, b)
+            elif b == 0:
+                return None
+            else:
+                # C truncates towards zero
+                value = abs(a) // abs(b)
+                if (a < 0) != (b < 0):
+                    value = -value
+                if value != int_types.wrap(value, typ):
+                    return None # `MIN / -1` traps
+                if kind == InstKind.Mod:
+                    value = a - b * value
+            return self.new_int_lit(typ, int_types.wrap(value, typ))
+        return None
+
+    def new_int_lit(self, typ, value):
+        if value > 0x7FFFFFFFFFFFFFFF:
+            # too large for a decimal constant in C
+            return ir.IntLit(typ, hex(value))
+        return ir.IntLit(typ, str(value))
+
+    # ---- copy propagation ----
+
+    def count_uses(self, decl):
+        # Returns how many times each name is used, not counting the
+        # declarations of the locals; the names in `escaped` have their
+        # address taken.
+        uses = {}
+        escaped = set()
+        for inst in decl.instrs:
+            if not isinstance(inst, ir.Inst):
+                continue
+            values = inst.args[1:] if inst.kind == InstKind.Alloca else inst.args
+            for value in values:
+                for v in walk(value):
+                    if isinstance(v, (ir.Ident, ir.Name)):
+                        uses[v.name] = uses.get(v.name, 0) + 1
+                    elif isinstance(v, str):
+                        uses[v] = uses.get(v, 0) + 1
+                    elif isinstance(v, ir.Inst) and v.kind == InstKind.GetPtr:
+                        if name := ident_name(v.args[0]):
+                            escaped.add(name)
+        return uses, escaped
+
+    def copy_prop(self, decl):
+        uses, escaped = self.count_uses(decl)
+        changes = 0
+        instrs = decl.instrs
+        # backwards, so chains of temporaries (like the arguments of an
+        # inlined call) are moved as a whole
+        for i in range(len(instrs) - 1, -1, -1):
+            inst = instrs[i]
+            if not (
+                isinstance(inst, ir.Inst) and inst.kind == InstKind.Alloca
+                and len(inst.args) == 2
+            ):
+                continue
+            var = inst.args[0]
+            if not TEMP_NAME.fullmatch(var.name) or uses.get(
+                var.name
+            ) != 1 or var.name in escaped or isinstance(var.typ, ir.Array):
+                continue
+            j = i + 1
+            while j < len(instrs) and isinstance(instrs[j], (ir.Comment, ir.Skip)):
+                j += 1
+            if j == len(instrs) or not isinstance(instrs[j], ir.Inst):
+                continue
+            value = self.coerce(inst.args[1], var.typ)
+            if value == None:
+                continue
+            if new := self.substitute(instrs[j], var.name, value, escaped):
+                instrs[j] = new
+                instrs[i] = ir.Skip()
+                changes += 1
+        decl.instrs = [inst for inst in instrs if not isinstance(inst, ir.Skip)]
+        return changes
+
+    def coerce(self, value, typ):
+        # The initializer of a local is converted to the type of the local;
+        # that conversion is kept with a cast, if needed.
+        if getattr(value, "typ", None) is typ:
+            return value
+        elif isinstance(typ, ir.Pointer) or self.int_types.info(typ) or (
+            isinstance(typ, ir.Type) and typ.name in ("float32", "float64")
+        ):
+            return ir.Inst(InstKind.Cast, [value, typ], typ)
+        return None
+
+    def substitute(self, inst, name, value, escaped):
+        # Returns `inst` using `value` instead of the local `name`, or `None`
+        # if the order of evaluation would change.
+        if inst.kind in (InstKind.Alloca, InstKind.DbgStmtLine):
+            start = 1 if inst.kind == InstKind.Alloca else len(inst.args)
+        else:
+            start = 0
+        slot = None
+        for idx in range(start, len(inst.args)):
+            if any(
+                isinstance(v, ir.Ident) and v.name == name
+                for v in walk(inst.args[idx])
+            ):
+                slot = idx
+                break
+        if slot == None:
+            return None
+        elif slot == 0 and inst.kind in LVALUE_INSTS and ident_name(
+            inst.args[0]
+        ) == name:
+            return None # written, not read
+        if inst.kind == InstKind.Call and slot == 0:
+            return None # called value
+        if isinstance(value, ir.Inst) and value.kind in UNWRAPPED_INSTS:
+            is_full_expr = slot in FULL_EXPR_ARGS.get(inst.kind, ()) or (
+                inst.kind == InstKind.Call
+            )
+            arg = inst.args[slot]
+            if not (is_full_expr and isinstance(arg, ir.Ident)):
+                return None
+        others = [
+            arg for idx, arg in enumerate(inst.args)
+            if idx != slot and idx >= start
+        ]
+        if inst.kind == InstKind.Alloca:
+            others = []
+        if has_effects(value):
+            # everything else that `inst` evaluates must not be affected by
+            # the effects of `value`
+            if not all(self.is_stable(arg, escaped) for arg in others):
+                return None
+        elif any(has_effects(arg) for arg in others):
+            return None
+        args = list(inst.args)
+        args[slot] = replace(args[slot], name, value)
+        return ir.Inst(inst.kind, args, inst.typ)
+
+    def is_stable(self, value, escaped):
+        # Returns `True` if evaluating `value` gives the same result before
+        # and after any call: literals, function names and the locals whose
+        # address is never taken.
+        for v in walk(value):
+            if isinstance(v, ir.Ident):
+                if not TEMP_NAME.fullmatch(v.name) or v.name in escaped:
+                    return False
+            elif isinstance(v, ir.Selector):
+                if isinstance(v.left.typ, ir.Pointer):
+                    return False
+            elif isinstance(v, ir.Inst):
+                if v.kind in (InstKind.LoadPtr, InstKind.Call):
+                    return False
+            elif not isinstance(
+                v, (
+                    str, ir.Name, ir.IntLit, ir.FloatLit, ir.RuneLit, ir.NoneLit,
+                    ir.StringLit, ir.Type, ir.Pointer, ir.Array, ir.Function
+                )
+            ):
+                return False
+        return True
+
+    # ---- dead temporaries ----
+
+    def dead_temps(self, decl):
+        # A temporary is dead if it is only declared and written.
+        reads = {}
+        temps = set()
+        for inst in decl.instrs:
+            if not isinstance(inst, ir.Inst):
+                continue
+            values = inst.args
+            if inst.kind == InstKind.Alloca:
+                if TEMP_NAME.fullmatch(inst.args[0].name):
+                    temps.add(inst.args[0].name)
+                values = inst.args[1:]
+            elif inst.kind == InstKind.Store and ident_name(inst.args[0]):
+                # writing a local or one of its fields does not read it
+                values = inst.args[1:]
+            for value in values:
+                for v in walk(value):
+                    if isinstance(v, (ir.Ident, ir.Name)):
+                        reads[v.name] = reads.get(v.name, 0) + 1
+                    elif isinstance(v, str):
+                        reads[v] = reads.get(v, 0) + 1
+        dead = set(name for name in temps if name not in reads)
+        if len(dead) == 0:
+            return 0
+        changes = 0
+        instrs = []
+        for inst in decl.instrs:
+            if isinstance(inst, ir.Inst):
+                if inst.kind == InstKind.Alloca and inst.args[0].name in dead:
+                    var_value = inst.args[1] if len(inst.args) == 2 else None
+                elif inst.kind == InstKind.Store and ident_name(
+                    inst.args[0]
+                ) in dead:
+                    var_value = inst.args[1]
+                else:
+                    instrs.append(inst)
+                    continue
+                if var_value != None and has_effects(var_value):
+                    if not (
+                        isinstance(var_value, ir.Inst)
+                        and var_value.kind == InstKind.Call
+                    ):
+                        instrs.append(inst) # keep it, it is not a statement
+                        continue
+                    instrs.append(var_value)
+                changes += 1
+            else:
+                instrs.append(inst)
+        decl.instrs = instrs
+        return changes
+
+    # ---- jump threading ----
+
+    def jump_threading(self, decl):
+        changes = 0
+        instrs = decl.instrs
+        # where each label jumps to, if it only jumps
+        labels = {}
+        for i, inst in enumerate(instrs):
+            if isinstance(inst, ir.Label):
+                j = i + 1
+                while j < len(instrs) and isinstance(
+                    instrs[j], (ir.Comment, ir.Label, ir.Skip)
+                ):
+                    j += 1
+                if j < len(instrs) and isinstance(instrs[j], ir.Inst) and instrs[
+                    j].kind == InstKind.Br and len(instrs[j].args) == 1:
+                    labels[inst.label] = instrs[j].args[0].name
+                elif j < len(instrs) and isinstance(instrs[j], ir.Label):
+                    labels[inst.label] = instrs[j].label
+        def target(label):
+            seen = set()
+            while label in labels and label not in seen:
+                seen.add(label)
+                label = labels[label]
+            return label
+
+        new_instrs = []
+        is_reachable = True
+        for inst in instrs:
+            if isinstance(inst, ir.Label):
+                is_reachable = True
+            elif not is_reachable and isinstance(inst, ir.Inst):
+                if inst.kind != InstKind.Alloca:
+                    changes += 1
+                    continue # unreachable
+            if isinstance(inst, ir.Inst) and inst.kind == InstKind.Br:
+                if len(inst.args) == 1:
+                    label = target(inst.args[0].name)
+                    if label != inst.args[0].name:
+                        inst = ir.Inst(InstKind.Br, [ir.Name(label)], inst.typ)
+                        changes += 1
+                    is_reachable = False
+                else:
+                    cond = inst.args[0]
+                    if lit := self.int_lit(cond):
+                        changes += 1
+                        idx = 1 if lit[1] != 0 else 2
+                        if idx < len(inst.args):
+                            label = target(inst.args[idx].name)
+                            inst = ir.Inst(InstKind.Br, [ir.Name(label)], inst.typ)
+                            is_reachable = False
+                            new_instrs.append(inst)
+                        continue # the condition is always false
+                    args = [cond] + [
+                        ir.Name(target(arg.name)) for arg in inst.args[1:]
+                    ]
+                    if any(
+                        new.name != old.name
+                        for new, old in zip(args[1:], inst.args[1:])
+                    ):
+                        inst = ir.Inst(InstKind.Br, args, inst.typ)
+                        changes += 1
+            elif isinstance(inst, ir.Inst) and inst.kind == InstKind.Switch:
+                args = list(inst.args)
+                for i in label_args(inst):
+                    args[i] = ir.Name(target(args[i].name))
+                if any(
+                    new.name != old.name for new, old in
+                    zip(args[1::2], inst.args[1::2])
+                ):
+                    inst = ir.Inst(InstKind.Switch, args, inst.typ)
+                    changes += 1
+                is_reachable = False
+            elif isinstance(inst, ir.Inst) and inst.kind == InstKind.Ret:
+                is_reachable = False
+            new_instrs.append(inst)
+
+        # remove the branches to the next label
+        instrs = []
+        for i, inst in enumerate(new_instrs):
+            if isinstance(inst, ir.Inst) and inst.kind == InstKind.Br and len(
+                inst.args
+            ) == 1:
+                j = i + 1
+                while j < len(new_instrs) and isinstance(
+                    new_instrs[j], (ir.Comment, ir.Skip, ir.Label)
+                ):
+                    if isinstance(new_instrs[j], ir.Label) and new_instrs[
+                        j].label == inst.args[0].name:
+                        break
+                    j += 1
+                if j < len(new_instrs) and isinstance(
+                    new_instrs[j], ir.Label
+                ) and new_instrs[j].label == inst.args[0].name:
+                    changes += 1
+                    continue
+            instrs.append(inst)
+
+        # remove the unused labels
+        used = set()
+        for inst in instrs:
+            if isinstance(inst, ir.Inst):
+                for i in label_args(inst):
+                    used.add(inst.args[i].name)
+        new_instrs = []
+        for inst in instrs:
+            if isinstance(inst, ir.Label) and inst.label not in used:
+                changes += 1
+                continue
+            new_instrs.append(inst)
+        decl.instrs = new_instrs
+        return changes
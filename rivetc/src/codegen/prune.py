@@ -0,0 +1,190 @@
+# Copyright (C) 2023 Jose Mendoza. All rights reserved.
+# Use of this source code is governed by an MIT license that can
+# be found in the LICENSE file.
+
+from . import ir
+
+class PruneStats:
+    def __init__(self):
+        self.funcs = 0
+        self.pruned_funcs = 0
+        self.globals = 0
+        self.pruned_globals = 0
+        self.types = 0
+        self.pruned_types = 0
+
+    def summary(self):
+        return [
+            f"functions and vtables: {self.funcs - self.pruned_funcs} emitted, {self.pruned_funcs} pruned",
+            f"globals: {self.globals - self.pruned_globals} emitted, {self.pruned_globals} pruned",
+            f"types: {self.types - self.pruned_types} emitted, {self.pruned_types} pruned"
+        ]
+
+class References:
+    def __init__(self):
+        self.names = set() # functions, globals and virtual tables
+        self.types = set()
+
+    def add_type(self, typ):
+        while isinstance(typ, (ir.Pointer, ir.Array)):
+            typ = typ.typ
+        if isinstance(typ, ir.Function):
+            args = typ.args if isinstance(typ.args, list) else [typ.args]
+            for arg in args:
+                self.add_value(arg)
+            self.add_type(typ.ret_typ)
+        elif isinstance(typ, ir.Type):
+            self.types.add(typ.name)
+
+    def add_value(self, value):
+        if isinstance(value, ir.Inst):
+            for arg in value.args:
+                self.add_value(arg)
+            self.add_type(value.typ)
+        elif isinstance(value, ir.Ident):
+            self.names.add(value.name)
+            self.add_type(value.typ)
+        elif isinstance(value, ir.Name):
+            self.names.add(value.name)
+        elif isinstance(value, str): # raw names of functions
+            self.names.add(value)
+        elif isinstance(value, ir.Selector):
+            # the field name is not a reference
+            self.add_value(value.left)
+            self.add_type(value.typ)
+        elif isinstance(value, ir.ArrayLit):
+            for elem in value.elems:
+                self.add_value(elem)
+            self.add_type(value.typ)
+        elif isinstance(value, ir.StructLit):
+            for _, field_value in value.fields:
+                self.add_value(field_value)
+            self.add_type(value.typ)
+        elif isinstance(
+            value, (ir.Type, ir.Pointer, ir.Array, ir.Function)
+        ):
+            self.add_type(value)
+        elif hasattr(value, "typ"):
+            self.add_type(value.typ)
+
+    def add_signature(self, decl):
+        # the types needed to declare `decl`
+        if isinstance(decl, ir.FuncDecl):
+            for arg in decl.args:
+                self.add_type(arg.typ)
+            self.add_type(decl.ret_typ)
+            if decl.arr_ret_struct:
+                self.types.add(decl.arr_ret_struct)
+        elif isinstance(decl, ir.VTable):
+            self.types.add(decl.structure)
+        elif isinstance(decl, ir.GlobalVar):
+            self.add_type(decl.typ)
+
+    def add_decl(self, decl):
+        if isinstance(decl, ir.FuncDecl):
+            for arg in decl.args:
+                self.add_value(arg)
+            self.add_type(decl.ret_typ)
+            if decl.arr_ret_struct:
+                self.types.add(decl.arr_ret_struct)
+            for local in decl.locals:
+                self.add_type(local.typ)
+            for inst in decl.instrs:
+                self.add_value(inst)
+        elif isinstance(decl, ir.VTable):
+            self.types.add(decl.structure)
+            self.types.add(decl.trait_name)
+            for funcs in decl.funcs:
+                self.names.update(funcs.values())
+        elif isinstance(decl, ir.GlobalVar):
+            self.add_type(decl.typ)
+            if decl.value:
+                self.add_value(decl.value)
+
+def used_types(types, names):
+    # Returns `names` and the names of the types used by their fields,
+    # transitively.
+    used = set()
+    worklist = list(names)
+    while len(worklist) > 0:
+        name = worklist.pop()
+        if name in used:
+            continue
+        used.add(name)
+        if typ := types.get(name):
+            field_refs = References()
+            for f in typ.fields:
+                field_refs.add_type(f.typ)
+            worklist += field_refs.types
+    return used
+
+def prune_unreachable(rir, keep = None):
+    """Removes the functions, globals and types of `rir` that cannot be
+    reached from `main`.
+
+    Everything referenced by name from a reachable function, global or
+    virtual table is reachable; test functions are referenced by the test
+    runner's `main`. The other roots are the virtual tables, whose methods
+    can be called through any trait object, the extern functions and the
+    functions with C names (exported with `#[export]`), since they can be
+    called from outside, and the functions for which `keep` returns `True`.
+    Public functions and globals are not roots: the output is always an
+    executable, so they are only kept if the program uses them.
+    """
+    stats = PruneStats()
+    decls = {}
+    for decl in rir.decls:
+        decls[decl.name] = decl
+    globals = {}
+    for g in rir.globals:
+        globals[g.name] = g
+
+    refs = References()
+    worklist = []
+    for decl in rir.decls:
+        if decl.name == "main" or isinstance(decl, ir.VTable) or (
+            isinstance(decl, ir.FuncDecl) and (
+                decl.is_extern or not decl.name.startswith("_R")
+                or (keep != None and keep(decl))
+            )
+        ):
+            worklist.append(decl.name)
+    for extern_fn in rir.externs:
+        refs.add_decl(extern_fn)
+    reachable = set()
+    while len(worklist) > 0:
+        name = worklist.pop()
+        if name in reachable:
+            continue
+        reachable.add(name)
+        decl = decls.get(name) or globals.get(name)
+        if decl == None:
+            continue
+        new_names = References()
+        new_names.add_decl(decl)
+        refs.types.update(new_names.types)
+        for ref in new_names.names:
+            if ref not in reachable and (ref in decls or ref in globals):
+                worklist.append(ref)
+
+    stats.funcs = len(rir.decls)
+    rir.decls = [decl for decl in rir.decls if decl.name in reachable]
+    stats.pruned_funcs = stats.funcs - len(rir.decls)
+
+    stats.globals = len(rir.globals)
+    rir.globals = [
+        g for g in rir.globals if g.name in reachable or g.is_extern
+    ]
+    stats.pruned_globals = stats.globals - len(rir.globals)
+    for g in rir.globals:
+        refs.add_decl(g)
+
+    # the fields of the used types use other types
+    types = {}
+    for typ in rir.types:
+        types[typ.name] = typ
+    types_names = used_types(types, refs.types)
+    stats.types = len(rir.types)
+    rir.types = [typ for typ in rir.types if typ.name in types_names]
+    stats.pruned_types = stats.types - len(rir.types)
+    return stats
@@ -0,0 +1,223 @@
+# Copyright (C) 2023 Jose Mendoza. All rights reserved.
+# Use of this source code is governed by an MIT license that can
+# be found in the LICENSE file.
+
+import math, struct
+
+from .token import Kind
+from .sym import TypeKind
+from . import ast, sym, type
+
+INT_BITS = {
+    TypeKind.Int8: (8, True), TypeKind.Int16: (16, True),
+    TypeKind.Int32: (32, True), TypeKind.Int64: (64, True),
+    TypeKind.Uint8: (8, False), TypeKind.Uint16: (16, False),
+    TypeKind.Uint32: (32, False), TypeKind.Uint64: (64, False)
+}
+
+class StringValue:
+    def __init__(self, lit):
+        self.lit = lit
+
+class ConstEval:
+    """Folds constant expressions of checked code into literals.
+
+    Integer operations wrap around like the C backend (which uses
+    `-fwrapv`) for the bit width of their type; `comptime_int` values are
+    not truncated. Anything that cannot be folded (division by zero,
+    over-wide shifts, calls, non-finite floats, etc.) returns `None` and
+    is generated as usual.
+    """
+    def __init__(self, comp):
+        self.comp = comp
+
+    def eval_const(self, const_sym):
+        # Saves the folded value of `const_sym` in `evaled_expr`.
+        if const_sym.has_evaled_expr:
+            if const_sym.evaled_expr.typ == None:
+                # folded by `Resolver.eval_size`
+                const_sym.evaled_expr.typ = const_sym.typ
+            return const_sym.evaled_expr
+        if lit := self.eval(const_sym.expr, const_sym.typ):
+            const_sym.evaled_expr = lit
+            const_sym.has_evaled_expr = True
+            return lit
+        return None
+
+    def eval(self, expr, typ):
+        value = self.eval_expr(expr)
+        if value == None:
+            return None
+        if isinstance(value, bool):
+            lit = ast.BoolLiteral(value, expr.pos)
+        elif isinstance(value, int):
+            value = self.wrap(value, typ)
+            if value > 0x7FFFFFFFFFFFFFFF:
+                lit = ast.IntegerLiteral(hex(value), expr.pos)
+            else:
+                lit = ast.IntegerLiteral(str(value), expr.pos)
+        elif isinstance(value, float):
+            if not math.isfinite(value):
+                return None
+            lit = ast.FloatLiteral(repr(value), expr.pos)
+        else:
+            lit = ast.StringLiteral(value.lit, False, False, False, expr.pos)
+        lit.typ = typ
+        return lit
+
+    def eval_expr(self, expr):
+        if isinstance(expr, ast.ParExpr):
+            return self.eval_expr(expr.expr)
+        elif isinstance(expr, ast.BoolLiteral):
+            return expr.lit
+        elif isinstance(expr, ast.IntegerLiteral):
+            return int(expr.lit, 0)
+        elif isinstance(expr, ast.FloatLiteral):
+            return self.wrap(float(expr.lit), expr.typ)
+        elif isinstance(expr, ast.StringLiteral):
+            if expr.is_raw or expr.is_bytestr or expr.is_cstr:
+                return None
+            return StringValue(expr.lit)
+        elif isinstance(expr, ast.Ident):
+            if isinstance(expr.sym, sym.Const):
+                return self.eval_const_value(expr.sym)
+        elif isinstance(expr, ast.SelectorExpr):
+            if expr.is_path and isinstance(expr.field_sym, sym.Const):
+                return self.eval_const_value(expr.field_sym)
+        elif isinstance(expr, ast.UnaryExpr):
+            right = self.eval_expr(expr.right)
+            if right == None:
+                return None
+            if expr.op == Kind.Bang and isinstance(right, bool):
+                return not right
+            elif expr.op == Kind.Minus and self.is_number(right):
+                return self.wrap(-right, expr.typ)
+            elif expr.op == Kind.BitNot and self.is_int(right):
+                return self.wrap(~right, expr.typ)
+        elif isinstance(expr, ast.BinaryExpr):
+            return self.eval_binary_expr(expr)
+        return None
+
+    def eval_const_value(self, const_sym):
+        if lit := self.eval_const(const_sym):
+            return self.eval_expr(lit)
+        return None
+
+    def eval_binary_expr(self, expr):
+        if expr.op in (Kind.LogicalAnd, Kind.LogicalOr):
+            left = self.eval_expr(expr.left)
+            if not isinstance(left, bool):
+                return None
+            if expr.op == Kind.LogicalAnd and not left:
+                return False
+            elif expr.op == Kind.LogicalOr and left:
+                return True
+            right = self.eval_expr(expr.right)
+            return right if isinstance(right, bool) else None
+        left = self.eval_expr(expr.left)
+        if left == None:
+            return None
+        right = self.eval_expr(expr.right)
+        if right == None:
+            return None
+        if isinstance(left, StringValue) and isinstance(right, StringValue):
+            # the literals are joined as written, so an escape sequence at
+            # the end of `left` could take the start of `right` (`"\0" +
+            # "12"` would be `\012`)
+            if expr.op == Kind.Plus and "\\" not in left.lit:
+                return StringValue(left.lit + right.lit)
+            return None
+        if not (self.is_number(left) and self.is_number(right)):
+            if isinstance(left, bool) and isinstance(right, bool):
+                if expr.op == Kind.Eq:
+                    return left == right
+                elif expr.op == Kind.Ne:
+                    return left != right
+            return None
+        if expr.op == Kind.Eq:
+            return left == right
+        elif expr.op == Kind.Ne:
+            return left != right
+        elif expr.op == Kind.Lt:
+            return left < right
+        elif expr.op == Kind.Gt:
+            return left > right
+        elif expr.op == Kind.Le:
+            return left <= right
+        elif expr.op == Kind.Ge:
+            return left >= right
+        is_float = isinstance(left, float) or isinstance(right, float)
+        if expr.op == Kind.Plus:
+            value = left + right
+        elif expr.op == Kind.Minus:
+            value = left - right
+        elif expr.op == Kind.Mul:
+            value = left * right
+        elif expr.op == Kind.Div:
+            if right == 0:
+                return None
+            if is_float:
+                value = left / right
+            else:
+                # C truncates towards zero
+                value = abs(left) // abs(right)
+                if (left < 0) != (right < 0):
+                    value = -value
+        elif is_float:
+            return None
+        elif expr.op == Kind.Mod:
+            if right == 0:
+                return None
+            value = abs(left) % abs(right)
+            if left < 0:
+                value = -value
+        elif expr.op == Kind.Amp:
+            value = left & right
+        elif expr.op == Kind.Pipe:
+            value = left | right
+        elif expr.op == Kind.Xor:
+            value = left ^ right
+        elif expr.op in (Kind.Lshift, Kind.Rshift):
+            bits, _ = self.int_bits(expr.typ)
+            if right < 0 or right >= (bits or 64):
+                return None
+            value = left << right if expr.op == Kind.Lshift else left >> right
+        else:
+            return None
+        return self.wrap(value, expr.typ)
+
+    def is_int(self, value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def is_number(self, value):
+        return self.is_int(value) or isinstance(value, float)
+
+    def int_bits(self, typ):
+        # Returns the bit width and signedness of `typ`, or `None` for
+        # `comptime_int` and non-integer types.
+        if not isinstance(typ, type.Type):
+            return None, False
+        kind = typ.symbol().kind
+        if kind == TypeKind.Alias:
+            return self.int_bits(typ.symbol().info.parent)
+        elif kind in (TypeKind.Int, TypeKind.Uint):
+            return self.comp.pointer_size * 8, kind == TypeKind.Int
+        elif kind == TypeKind.Enum and not typ.symbol().info.is_tagged:
+            return self.int_bits(typ.symbol().info.underlying_typ)
+        return INT_BITS.get(kind, (None, False))
+
+    def wrap(self, value, typ):
+        if isinstance(value, float):
+            if isinstance(typ, type.Type) and typ.symbol().kind == TypeKind.Float32:
+                try:
+                    return struct.unpack("f", struct.pack("f", value))[0]
+                except OverflowError:
+                    return math.inf
+            return value
+        bits, is_signed = self.int_bits(typ)
+        if bits == None:
+            return value
+        value &= (1 << bits) - 1
+        if is_signed and value >= 1 << (bits - 1):
+            value -= 1 << bits
+        return value
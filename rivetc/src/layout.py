@@ -0,0 +1,264 @@
+# Copyright (C) 2023 Jose Mendoza. All rights reserved.
+# Use of this source code is governed by an MIT license that can
+# be found in the LICENSE file.
+
+from . import sym, type, utils
+from .sym import TypeKind
+
+class TypeLayout:
+    def __init__(self, size, align, offsets = None, fields = None):
+        self.size = size
+        self.align = align
+        # field name -> offset (in bytes), in the same order that the
+        # fields are generated by the C backend
+        self.offsets = offsets if offsets != None else {}
+        # the fields of a struct, in the order used by the C backend
+        self.fields = fields if fields != None else []
+
+class Layout:
+    """Computes the size, alignment and field offsets of the types, the same
+    way the C backend lays them out.
+
+    The layout of a type symbol is computed only once and saved in
+    `sym.Type.layout`; the layouts of `Result` and `Option` are saved by
+    the symbol of their value type.
+    """
+    def __init__(self, comp):
+        self.comp = comp
+        self.pointer = TypeLayout(comp.pointer_size, comp.pointer_size)
+        self.result_layouts = {}
+        self.option_layouts = {}
+        self.saved_bytes = 0
+
+    def compute_all(self, root):
+        # the layouts of the field types are always computed first, so a
+        # single walk follows the dependency order
+        for s in root.syms:
+            if isinstance(s, sym.Type) and s.kind != TypeKind.Placeholder:
+                self.type_symbol_layout(s)
+            if isinstance(s, (sym.Mod, sym.Type)):
+                self.compute_all(s)
+
+    def type_layout(self, typ):
+        if isinstance(typ, (type.Ptr, type.Func, type.Boxedptr)):
+            return self.pointer
+        elif isinstance(typ, type.Option):
+            if typ.is_pointer():
+                return self.pointer
+            elif self.option_niche(typ.typ) != None:
+                return self.type_layout(typ.typ)
+            key = self.wrapper_key(typ.typ)
+            if layout := self.option_layouts.get(key):
+                return layout
+            layout = self.struct_layout([
+                ("value", self.value_layout(typ.typ)),
+                ("is_none", self.bool_layout())
+            ])
+            self.option_layouts[key] = layout
+            return layout
+        elif isinstance(typ, type.Result):
+            key = self.wrapper_key(typ.typ)
+            if layout := self.result_layouts.get(key):
+                return layout
+            layout = self.struct_layout([
+                ("value", self.value_layout(typ.typ)),
+                ("is_err", self.bool_layout()),
+                ("err", self.type_layout(self.comp.throwable_t))
+            ])
+            self.result_layouts[key] = layout
+            return layout
+        return self.type_symbol_layout(typ.symbol())
+
+    def wrapper_key(self, typ):
+        if isinstance(typ, type.Type):
+            return typ.symbol().id
+        return typ.qualstr()
+
+    def value_layout(self, typ):
+        if typ in (self.comp.void_t, self.comp.never_t):
+            return self.type_symbol_layout(self.comp.uint8_t.symbol())
+        return self.type_layout(typ)
+
+    def enum_tag_type(self, sy):
+        # The smallest unsigned integer type that fits the tags (the values
+        # of the variants) of the tagged enum `sy`.
+        values = [int(v.value, 0) for v in sy.info.variants]
+        if len(values) > 0 and min(values) >= 0:
+            for typ in (
+                self.comp.uint8_t, self.comp.uint16_t, self.comp.uint32_t
+            ):
+                if max(values) < 1 << (self.type_layout(typ).size * 8):
+                    return typ
+        return self.comp.uint_t
+
+    def option_niche(self, typ):
+        # Returns the value that represents `none` in a `?typ`, if `typ` has
+        # a value that it never uses: `2` for `bool`, and a value that no
+        # variant has for the enums without tags. Such options are stored
+        # as a plain `typ`, without the `is_none` field. Returns `None` for
+        # the other types.
+        if typ == self.comp.bool_t:
+            return 2
+        elif not isinstance(typ, type.Type):
+            return None
+        sy = typ.symbol()
+        if sy.kind != TypeKind.Enum or sy.info.is_tagged or len(
+            sy.info.variants
+        ) == 0:
+            return None
+        underlying_sym = sy.info.underlying_typ.symbol()
+        while underlying_sym.kind == TypeKind.Alias:
+            underlying_sym = underlying_sym.info.parent.symbol()
+        bits = self.type_symbol_layout(underlying_sym).size * 8
+        if underlying_sym.kind in (
+            TypeKind.Uint8, TypeKind.Uint16, TypeKind.Uint32, TypeKind.Uint64,
+            TypeKind.Uint
+        ):
+            min_value, max_value = 0, (1 << bits) - 1
+        else:
+            min_value, max_value = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+        values = [int(v.value, 0) for v in sy.info.variants]
+        if max(values) < max_value:
+            return max(values) + 1
+        elif min(values) > min_value:
+            return min(values) - 1
+        return None
+
+    def bool_layout(self):
+        return self.type_symbol_layout(self.comp.bool_t.symbol())
+
+    def type_symbol_layout(self, sy):
+        if sy.layout != None:
+            return sy.layout
+        elif sy.kind == TypeKind.Placeholder:
+            return TypeLayout(0, 0) # not cached, it can be updated later
+        offsets, fields = None, None
+        size, align = 0, 0
+        if sy.kind in (TypeKind.Void, TypeKind.None_, TypeKind.Never):
+            pass
+        elif sy.kind == TypeKind.Alias:
+            layout = self.type_layout(sy.info.parent)
+            size, align = layout.size, layout.align
+            offsets, fields = layout.offsets, layout.fields
+        elif sy.kind in (TypeKind.Uint, TypeKind.Int):
+            size, align = self.comp.pointer_size, self.comp.pointer_size
+        elif sy.kind in (TypeKind.Int8, TypeKind.Uint8, TypeKind.Bool):
+            size, align = 1, 1
+        elif sy.kind in (TypeKind.Int16, TypeKind.Uint16):
+            size, align = 2, 2
+        elif sy.kind in (
+            TypeKind.Int32, TypeKind.Uint32, TypeKind.Rune, TypeKind.Float32
+        ):
+            size, align = 4, 4
+        elif sy.kind in (
+            TypeKind.Int64, TypeKind.Uint64, TypeKind.Float64,
+            TypeKind.ComptimeFloat, TypeKind.ComptimeInt
+        ):
+            size, align = 8, 8
+        elif sy.kind == TypeKind.Enum:
+            if sy.info.is_tagged:
+                if sy.info.is_boxed:
+                    size, align = self.comp.pointer_size, self.comp.pointer_size
+                else:
+                    # struct { uintN _idx_; union { ... } obj; }
+                    union_size, union_align = 0, 1
+                    for variant in sy.info.variants:
+                        if variant.has_typ:
+                            layout = self.type_layout(variant.typ)
+                            union_size = max(union_size, layout.size)
+                            union_align = max(union_align, layout.align)
+                    union = TypeLayout(
+                        utils.round_up(union_size, union_align), union_align
+                    )
+                    layout = self.struct_layout([
+                        ("_idx_", self.type_layout(self.enum_tag_type(sy))),
+                        ("obj", union)
+                    ])
+                    size, align, offsets = layout.size, layout.align, layout.offsets
+            else:
+                layout = self.type_layout(sy.info.underlying_typ)
+                size, align = layout.size, layout.align
+        elif sy.kind == TypeKind.Array:
+            layout = self.type_layout(sy.info.elem_typ)
+            size, align = int(sy.info.size.lit) * layout.size, layout.align
+        elif sy.kind == TypeKind.Slice:
+            size, align = self.comp.pointer_size * 3, self.comp.pointer_size
+        elif sy.is_boxed():
+            size, align = self.comp.pointer_size, self.comp.pointer_size
+            if isinstance(sy.info, sym.StructInfo):
+                # the C struct is still generated for the boxed value; its
+                # fields can refer to `sy` itself
+                sy.layout = TypeLayout(size, align)
+                sy.layout.fields = self.struct_fields(sy)
+                return sy.layout
+        elif sy.kind == TypeKind.Tuple:
+            layout = self.struct_layout([
+                (f"f{i}", self.type_layout(t))
+                for i, t in enumerate(sy.info.types)
+            ])
+            size, align, offsets = layout.size, layout.align, layout.offsets
+        elif sy.kind == TypeKind.Struct:
+            fields = self.struct_fields(sy)
+            layout = self.struct_layout([
+                (f.name, self.type_layout(f.typ)) for f in fields
+            ])
+            size, align, offsets = layout.size, layout.align, layout.offsets
+        else:
+            raise Exception(
+                f"Layout.type_symbol_layout(): unsupported type `{sy.qualname()}`"
+            )
+        sy.layout = TypeLayout(size, align, offsets, fields)
+        return sy.layout
+
+    def struct_fields(self, sy):
+        # The fields of the bases go first and keep their layout, so only
+        # the fields declared by `sy` itself can be reordered.
+        fields = []
+        for base_t in sy.info.traits:
+            fields += base_t.full_fields()
+        for base in sy.info.bases:
+            fields += self.type_symbol_layout(base).fields
+        if sy.info.is_opaque or not self.can_reorder_fields(sy):
+            return fields + sy.fields
+        own_fields = sorted(
+            sy.fields, key = lambda f: self.type_layout(f.typ).align,
+            reverse = True
+        )
+        old_size = self.struct_layout([
+            (f.name, self.type_layout(f.typ)) for f in fields + sy.fields
+        ]).size
+        new_size = self.struct_layout([
+            (f.name, self.type_layout(f.typ)) for f in fields + own_fields
+        ]).size
+        if new_size < old_size:
+            self.saved_bytes += old_size - new_size
+            self.comp.vlog(
+                f"reorder fields: `{sy.qualname()}` {old_size} -> {new_size} bytes"
+            )
+            return fields + own_fields
+        return fields + sy.fields
+
+    def can_reorder_fields(self, sy):
+        # the structs of the `c` modules mirror C declarations
+        mod = sy.mod()
+        mod_name = mod.qualname()
+        if sy.info.has_c_layout or mod_name == "c" or mod_name.startswith(
+            "c."
+        ):
+            return False
+        if self.comp.prefs.reorder_fields:
+            return True
+        return mod.attributes != None and mod.attributes.has("reorder_fields")
+
+    def struct_layout(self, fields):
+        offsets = {}
+        total_size = 0
+        max_alignment = 0
+        for name, layout in fields:
+            if layout.align > max_alignment:
+                max_alignment = layout.align
+            offsets[name] = utils.round_up(total_size, layout.align)
+            total_size = offsets[name] + layout.size
+        return TypeLayout(
+            utils.round_up(total_size, max_alignment), max_alignment, offsets
+        )
@@ -6,7 +6,7 @@ import os, glob
 
 from .token import Kind
 from .lexer import Lexer
-from . import ast, sym, type, prefs, report, token, utils
+from . import ast, sym, type, prefs, report, token, utils, cache
 
 class Parser:
     def __init__(self, comp):
@@ -20,6 +20,7 @@ class Parser:
 
         self.file_path = ""
         self.file_dir = ""
+        self.body_ranges = []
         self.mod_sym = None
 
         self.scope = None
@@ -48,8 +49,15 @@ class Parser:
         self.lexer = Lexer.from_file(self.comp, file)
         if report.ERRORS > 0:
             return ast.SourceFile(file, [], None)
+        self.body_ranges = []
         self.advance(2)
-        return ast.SourceFile(file, self.parse_decls(), self.mod_sym)
+        sf = ast.SourceFile(file, self.parse_decls(), self.mod_sym)
+        if self.comp.prefs.check:
+            # only `check` uses the hashes, to replay its cache
+            sf.interface_hash = cache.hash_interface(
+                self.lexer.all_tokens, self.body_ranges
+            )
+        return sf
 
     # ---- useful functions for working with tokens ----
     def next(self):
@@ -648,20 +656,30 @@ class Parser:
 
         stmts = []
         has_body = True
+        body_start = 0
         if (self.inside_trait
             or self.inside_extern) and self.accept(Kind.Semicolon):
             has_body = False
         else:
+            # `self.tok` is two tokens behind the lexer
+            body_start = self.lexer.tidx - 2
             self.expect(Kind.Lbrace)
             while not self.accept(Kind.Rbrace):
                 stmts.append(self.parse_stmt())
         self.close_scope()
-        return ast.FuncDecl(
+        func_decl = ast.FuncDecl(
             doc_comment, attributes, is_public, self.inside_extern, is_unsafe,
             name, pos, args, ret_typ, stmts, sc, has_body, is_method,
             self_is_mut, self_is_ptr, has_named_args, self.mod_sym.is_root
             and self.mod_sym.name != "core" and name == "main", is_variadic, abi
         )
+        if has_body and self.comp.prefs.check:
+            body_end = self.lexer.tidx - 2
+            self.body_ranges.append((body_start, body_end))
+            func_decl.body_hash = cache.hash_tokens(
+                self.lexer.all_tokens[body_start:body_end]
+            )
+        return func_decl
 
     # ---- statements --------------------------
     def decl_operator_is_used(self):
@@ -13,6 +13,13 @@ from .utils import error, eprint, execute, is_valid_name, full_version, HELP
 RIVET_DIR = path.join(path.expanduser("~"), ".rivet_lang")
 RIVETC_DIR = path.dirname(path.realpath(sys.argv[0]))
 
+# the optimization passes over the RIR, in the order they are run, see
+# `codegen.opt.PassManager`
+OPT_PASSES = (
+    "escape", "inline", "devirt", "fold", "copy-prop", "dead-temps",
+    "jump-threading"
+)
+
 def option(args, param):
     for i, arg in enumerate(args):
         if param == arg:
@@ -161,6 +168,13 @@ class Prefs:
         self.check = False
         self.emit_rir = False
         self.keep_c = False
+        self.reorder_fields = False
+        self.show_stats = False
+        self.show_cache_stats = False
+        self.opt_passes = None
+        self.remove_bounds_checks = True
+        self.lower_fmt_literals = True
+        self.fuse_string_concat = True
         self.is_verbose = False
 
         if len(args) == 0:
@@ -277,6 +291,36 @@ class Prefs:
                 self.emit_rir = True
             elif arg == "--keep-c":
                 self.keep_c = True
+            elif arg == "--reorder-fields":
+                self.reorder_fields = True
+            elif arg == "--stats":
+                self.show_stats = True
+            elif arg == "--cache-stats":
+                self.show_cache_stats = True
+            elif arg == "--opt-passes":
+                if passes := option(current_args, arg):
+                    if passes == "all":
+                        self.opt_passes = list(OPT_PASSES)
+                    elif passes == "none":
+                        self.opt_passes = []
+                    else:
+                        names = passes.split(",")
+                        for name in names:
+                            if name not in OPT_PASSES:
+                                error(f"unknown optimization pass: `{name}`")
+                        # the passes always run in the same order
+                        self.opt_passes = [
+                            name for name in OPT_PASSES if name in names
+                        ]
+                else:
+                    error(f"`{arg}` requires a list of passes as argument")
+                i += 1
+            elif arg == "--no-bounds-check-elim":
+                self.remove_bounds_checks = False
+            elif arg == "--no-fmt-lowering":
+                self.lower_fmt_literals = False
+            elif arg == "--no-concat-fusion":
+                self.fuse_string_concat = False
             elif arg in ("-v", "--verbose"):
                 self.is_verbose = True
             elif arg.startswith("-"):
@@ -297,6 +341,11 @@ class Prefs:
 
         self.build_rivet_dir()
 
+        if self.opt_passes == None:
+            self.opt_passes = list(
+                OPT_PASSES
+            ) if self.build_mode == BuildMode.Release else []
+
         if self.build_mode == BuildMode.Test:
             self.mod_output = f"_tests_runner__{self.mod_name}_"
         elif len(self.mod_output) == 0:
@@ -313,10 +362,8 @@ class Prefs:
         ) else self.input
 
     def build_rivet_dir(self):
-        if not path.isdir(RIVET_DIR):
-            os.mkdir(RIVET_DIR)
-            os.mkdir(path.join(RIVET_DIR, "obj"))
-            os.mkdir(path.join(RIVET_DIR, "lib"))
+        os.makedirs(path.join(RIVET_DIR, "obj"), exist_ok = True)
+        os.makedirs(path.join(RIVET_DIR, "lib"), exist_ok = True)
 
     def get_obj_postfix(self):
         postfix = str(self.target_os).lower()
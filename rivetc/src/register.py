@@ -92,7 +92,9 @@ class Register:
                                 decl.is_public, decl.name, TypeKind.Struct,
                                 info = sym.StructInfo(
                                     decl.is_opaque,
-                                    is_boxed = decl.attributes.has("boxed")
+                                    is_boxed = decl.attributes.has("boxed"),
+                                    has_c_layout = self.abi != sym.ABI.Rivet
+                                    or decl.attributes.has("c_layout")
                                 )
                             )
                         )
@@ -9,12 +9,34 @@ from .utils import CompilerError
 
 SYMBOL_COUNT = 0
 
+# The member tables of the types are only used once the resolver has
+# added all the bases and traits; any later change to a type bumps the
+# epoch, which invalidates every table.
+MEMBER_TABLES_READY = False
+MEMBER_TABLES_EPOCH = 0
+
 def new_symbol_id():
     global SYMBOL_COUNT
     ret = SYMBOL_COUNT
     SYMBOL_COUNT += 1
     return ret
 
+def build_member_tables(universe):
+    global MEMBER_TABLES_READY
+    MEMBER_TABLES_READY = True
+    _build_member_tables(universe)
+
+def _build_member_tables(sy):
+    for s in sy.syms:
+        if isinstance(s, Type):
+            s.has_member_tables()
+        if isinstance(s, (Mod, Type)):
+            _build_member_tables(s)
+
+def invalidate_member_tables():
+    global MEMBER_TABLES_EPOCH
+    MEMBER_TABLES_EPOCH += 1
+
 class ObjLevel(Enum):
     Rec = auto_enum()
     Arg = auto_enum()
@@ -110,6 +132,7 @@ class Sym:
         self.qualified_name = ""
         self.parent = None
         self.syms = []
+        self.syms_table = {}
         self.is_universe = isinstance(self, Mod) and self.id == 0
         self.is_root = False
 
@@ -124,21 +147,21 @@ class Sym:
             )
         sym.parent = self
         self.syms.append(sym)
+        self.syms_table[sym.name] = sym
 
     def add_and_return(self, sym):
-        idx = len(self.syms)
-        for i, asym in enumerate(self.syms):
-            if asym.name == sym.name:
-                if isinstance(asym, Type) and asym.kind == TypeKind.Placeholder:
-                    # update placeholder
-                    asym.update(sym)
-                    return self.syms[i]
-                raise CompilerError(
-                    f"{self.typeof()} `{self.name}` has duplicate symbol `{sym.name}`"
-                )
+        if asym := self.syms_table.get(sym.name):
+            if isinstance(asym, Type) and asym.kind == TypeKind.Placeholder:
+                # update placeholder
+                asym.update(sym)
+                return asym
+            raise CompilerError(
+                f"{self.typeof()} `{self.name}` has duplicate symbol `{sym.name}`"
+            )
         sym.parent = self
         self.syms.append(sym)
-        return self.syms[idx]
+        self.syms_table[sym.name] = sym
+        return sym
 
     def add_or_get_mod(self, sym):
         if m := self.find(sym.name):
@@ -153,10 +176,7 @@ class Sym:
         return syms
 
     def find(self, name):
-        for sym in self.syms:
-            if sym.name == name:
-                return sym
-        return None
+        return self.syms_table.get(name)
 
     def exists(self, name):
         if _ := self.find(name):
@@ -551,12 +571,18 @@ class TraitInfo:
         self.has_objects = True
 
 class StructInfo:
-    def __init__(self, is_opaque, is_boxed = False, is_enum_variant = False):
+    def __init__(
+        self, is_opaque, is_boxed = False, is_enum_variant = False,
+        has_c_layout = False
+    ):
         self.bases = []
         self.traits = []
         self.is_boxed = is_boxed
         self.is_opaque = is_opaque
         self.is_enum_variant = is_enum_variant
+        # declared inside an `extern` block or with `#[c_layout]`: the
+        # fields keep their order, to match a C declaration
+        self.has_c_layout = has_c_layout
 
 class Type(Sym):
     def __init__(self, is_public, name, kind, fields = [], info = None):
@@ -565,11 +591,69 @@ class Type(Sym):
         self.fields = fields.copy()
         self.full_fields_ = []
         self.info = info
-        self.size = -1
-        self.align = -1
+        self.layout = None # see `layout.py`
         self.default_value = None
+        self.fields_table = {}
+        self.members_table = {}
+        self.tables_epoch = -1
+
+    def add(self, sym):
+        Sym.add(self, sym)
+        self.invalidate_member_tables()
+
+    def add_and_return(self, sym):
+        sym = Sym.add_and_return(self, sym)
+        self.invalidate_member_tables()
+        return sym
+
+    def invalidate_member_tables(self):
+        self.tables_epoch = -1
+        # the tables of other types can only contain the members of
+        # this type if it was already registered
+        if MEMBER_TABLES_READY and self.parent != None:
+            invalidate_member_tables()
+
+    def has_member_tables(self):
+        if not MEMBER_TABLES_READY:
+            return False
+        if self.tables_epoch != MEMBER_TABLES_EPOCH:
+            self.build_member_tables()
+        return True
+
+    def build_member_tables(self):
+        # follows the same lookup order as `find_field`, `find` and
+        # `full_fields`
+        self.tables_epoch = MEMBER_TABLES_EPOCH
+        fields_table = {f.name: f for f in reversed(self.fields)}
+        members_table = self.syms_table.copy()
+        full_fields = []
+        if self.kind == TypeKind.Struct:
+            for base_t in self.info.traits:
+                base_t.has_member_tables()
+                for name, f in base_t.fields_table.items():
+                    fields_table.setdefault(name, f)
+                for name, s in base_t.members_table.items():
+                    members_table.setdefault(name, s)
+                full_fields += base_t.full_fields_
+            for base in self.info.bases:
+                base.has_member_tables()
+                for name, f in base.fields_table.items():
+                    fields_table.setdefault(name, f)
+                for name, s in base.syms_table.items():
+                    members_table.setdefault(name, s)
+                full_fields += base.full_fields_
+        elif self.kind == TypeKind.Trait:
+            for base in self.info.bases:
+                for name, s in base.syms_table.items():
+                    members_table.setdefault(name, s)
+        full_fields += self.fields
+        self.fields_table = fields_table
+        self.members_table = members_table
+        self.full_fields_ = full_fields
 
     def find_field(self, name):
+        if self.has_member_tables():
+            return self.fields_table.get(name)
         for f in self.fields:
             if f.name == name:
                 return f
@@ -602,6 +686,8 @@ class Type(Sym):
         return None
 
     def find(self, name):
+        if self.has_member_tables():
+            return self.members_table.get(name)
         if s := Sym.find(self, name):
             return s
         if s := self.find_in_base(name):
@@ -609,7 +695,7 @@ class Type(Sym):
         return None
 
     def full_fields(self):
-        if len(self.full_fields_) > 0:
+        if self.has_member_tables():
             return self.full_fields_
         fields = []
         if self.kind == TypeKind.Struct:
@@ -619,7 +705,6 @@ class Type(Sym):
                 fields += base.full_fields()
         for f in self.fields:
             fields.append(f)
-        self.full_fields_ = fields
         return fields
 
     def update(self, other):
@@ -631,6 +716,7 @@ class Type(Sym):
             for ss in other.syms:
                 self.add(ss)
             self.info = other.info
+            self.invalidate_member_tables()
 
     def implement_trait(self, trait_sym):
         return self in trait_sym.info.implements
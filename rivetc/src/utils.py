@@ -3,7 +3,7 @@
 # be found in the LICENSE file.
 
 from io import StringIO
-import os, sys, subprocess
+import os, sys, tempfile, subprocess
 
 VERSION = "0.1.0a"
 HELP = """Usage: rivetc [OPTIONS] INPUT
@@ -69,6 +69,9 @@ Options:
 
    --check
       Scans, parses, and checks the files without compiling the module.
+      Functions that were checked without errors or warnings are cached
+      in `~/.rivet_lang/cache` and skipped while their bodies and the
+      declarations of the module don't change.
 
    --emit-rir
       Emit Rivet Intermediate Representation to a file.
@@ -76,6 +79,43 @@ Options:
    --keep-c
       Don't remove the output C source file.
 
+   --reorder-fields
+      Sort the fields of the structs by alignment to reduce padding, as
+      if all the modules used `#![reorder_fields]`. The fields inherited
+      from bases keep their order, and so do the fields of the structs
+      of the `c` modules, of `extern` blocks and with `#[c_layout]`.
+
+   --stats
+      Print how many functions, globals and types were emitted and how
+      many were pruned because they are unreachable from `main`, and how
+      many bounds checks were removed.
+
+   --cache-stats
+      Print the hits and misses of the object file cache used for the
+      generated C code, and how much space the cache uses.
+
+   --opt-passes <passes>
+      Select the optimization passes run over the intermediate
+      representation: a comma-separated list of `escape`, `inline`,
+      `devirt`, `fold`, `copy-prop`, `dead-temps` and `jump-threading`, or
+      `all` or `none`.
+      All the passes are run in release mode, none in other modes.
+
+   --no-bounds-check-elim
+      Keep the bounds checks of all the indexing expressions, including
+      the ones that can be proven to be in bounds (constant indexes into
+      fixed arrays and loop indexes into the iterated value).
+
+   --no-fmt-lowering
+      Format the literal format strings of `string.fmt`, `console_write`
+      and `console_writeln` calls at runtime, instead of generating the
+      writes of their text and arguments at compile time.
+
+   --no-concat-fusion
+      Call `string.+` once for each `+` of a chain of string
+      concatenations, instead of concatenating all the operands with a
+      single call.
+
    -v, --verbose
       Print additional messages to the console.
 
@@ -189,6 +229,37 @@ class Builder:
     def __str__(self):
         return self.buf.getvalue()
 
+class FileBuilder(Builder):
+    """A `Builder` that writes the text to a temporary file, so its size
+    does not matter."""
+    def __init__(self):
+        self.buf = tempfile.TemporaryFile("w+", encoding = "UTF-8")
+        self.len_ = 0
+
+    def clear(self):
+        self.buf.seek(0)
+        self.buf.truncate()
+        self.len_ = 0
+
+    def copy_to(self, out, chunk_size = 1 << 16):
+        # Copies the text written so far to `out` (anything with a `write`
+        # method), a chunk at a time.
+        self.buf.seek(0)
+        while chunk := self.buf.read(chunk_size):
+            out.write(chunk)
+        self.buf.seek(0, os.SEEK_END)
+
+    def close(self):
+        self.buf.close()
+
+    def __len__(self):
+        return self.len_
+
+    def __str__(self):
+        sb = Builder()
+        self.copy_to(sb)
+        return str(sb)
+
 class CompilerError(Exception):
     pass
 
@@ -14,3 +14,6 @@ if os.system(f"{py_exe} tests/run_b_invalid_tests.py") != 0:
 print()
 if os.system(f"{py_exe} tests/run_invalid_tests.py") != 0:
     exit(1)
+print()
+if os.system(f"{py_exe} tests/run_c_output_tests.py") != 0:
+    exit(1)
@@ -0,0 +1,58 @@
+# Copyright (C) 2023 Jose Mendoza. All rights reserved.
+# Use of this source code is governed by an MIT license that can
+# be found in the LICENSE file.
+
+import glob, os, sys, time, utils
+
+# benchmark -> the option that disables the optimization that it measures
+BENCHMARKS = {
+    "fmt": "--no-fmt-lowering", # literal format strings
+    "concat": "--no-concat-fusion", # chains of string concatenations
+}
+RUNS = 5
+
+def build(file, output, *options):
+    res = utils.run_process(
+        sys.executable, "rivetc", "-r", "-o", output, *options, file
+    )
+    if res.exit_code != 0:
+        utils.eprint("    > fail:", res.err)
+        exit(1)
+
+def best_time(output):
+    # Returns the lowest running time of `output`, in seconds, and its
+    # output.
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        res = utils.run_process("./" + output)
+        elapsed = time.perf_counter() - start
+        if res.exit_code != 0:
+            utils.eprint("    > fail:", res.err)
+            exit(1)
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, res.out
+
+def run_benchmarks():
+    files = glob.glob(os.path.join("tests", "benchmarks", "*.ri"))
+    for i, file in enumerate(files):
+        name = utils.filename(file)
+        option = BENCHMARKS[name]
+        utils.eprint(f" [{i+1}/{len(files)}] {file}")
+        build(file, f"{name}_bench")
+        build(file, f"{name}_bench_base", option)
+        opt_time, opt_out = best_time(f"{name}_bench")
+        base_time, base_out = best_time(f"{name}_bench_base")
+        os.remove(f"{name}_bench")
+        os.remove(f"{name}_bench_base")
+        if opt_out != base_out:
+            utils.eprint(utils.bold(utils.red("    > outputs differ")))
+            return 1
+        utils.eprint(f"    {option}: {base_time * 1000:.1f} ms")
+        utils.eprint(
+            f"    default: {opt_time * 1000:.1f} ms ({base_time / opt_time:.2f}x)"
+        )
+    return 0
+
+exit(run_benchmarks())
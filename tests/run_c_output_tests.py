@@ -0,0 +1,69 @@
+# Copyright (C) 2023 Jose Mendoza. All rights reserved.
+# Use of this source code is governed by an MIT license that can
+# be found in the LICENSE file.
+
+import glob, os, sys, tempfile, utils
+
+# Each test file starts with `// present: <symbol>` and `// absent: <symbol>`
+# lines, the symbols that must (or must not) be in the generated C code, and
+# optionally a `// flags: <flags>` line, the options passed to the compiler.
+def test_header(file):
+    present, absent, flags = [], [], []
+    with open(file, encoding = "UTF-8") as f:
+        for line in f:
+            if line.startswith("// present:"):
+                present.append(line.split(":", 1)[1].strip())
+            elif line.startswith("// absent:"):
+                absent.append(line.split(":", 1)[1].strip())
+            elif line.startswith("// flags:"):
+                flags.extend(line.split(":", 1)[1].split())
+            else:
+                break
+    return present, absent, flags
+
+def run_c_output_tests():
+    ok, fail = 0, 0
+    rivetc = os.path.abspath("rivetc")
+    FILES = glob.glob(os.path.join("tests", "c_output", "*.ri"))
+    for i, file in enumerate(FILES):
+        start = f" [{i+1}/{len(FILES)}]"
+        present, absent, flags = test_header(file)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # the C files are written in the current directory
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            res = utils.run_process(
+                sys.executable, rivetc, *flags, "--keep-c", "-o",
+                utils.filename(file), os.path.join(cwd, file)
+            )
+            c_code = ""
+            for c_file in glob.glob("*.c"):
+                with open(c_file, encoding = "UTF-8") as f:
+                    c_code += f.read()
+            os.chdir(cwd)
+        errors = []
+        if res.exit_code != 0:
+            errors.append(res.err)
+        for symbol in present:
+            if symbol not in c_code:
+                errors.append(f"`{symbol}` is missing")
+        for symbol in absent:
+            if symbol in c_code:
+                errors.append(f"`{symbol}` should not be generated")
+        if len(errors) == 0:
+            utils.eprint(start, file, utils.bold(utils.green("-> OK")))
+            ok += 1
+        else:
+            utils.eprint(start, file, utils.bold(utils.red("-> FAIL")))
+            for error in errors:
+                utils.eprint("   ", error)
+            fail += 1
+    utils.eprint(utils.bold("Summary for all tests: "), end = "")
+    if ok > 0:
+        utils.eprint(utils.bold(utils.green(f"{ok} passed")) + ", ", end = "")
+    if fail > 0:
+        utils.eprint(utils.bold(utils.red(f"{fail} failed")) + ", ", end = "")
+    utils.eprint(utils.bold(f"{len(FILES)} total."))
+    return 1 if fail > 0 else 0
+
+exit(run_c_output_tests())